@@ -12,6 +12,7 @@
 import os
 import datetime
 import calendar
+import json
 
 import numpy as np
 import pandas as pd
@@ -22,6 +23,13 @@ import mtpy.processing.filter as mtfilter
 
 import matplotlib.pyplot as plt
 
+# feather files are optional and need pyarrow
+try:
+    import pyarrow
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
 #==============================================================================
 
 #==============================================================================
@@ -70,13 +78,15 @@ class MT_TS(object):
     units                units of time series
     ==================== ==================================================
     
-    .. note:: Currently only supports hdf5 and text files
+    .. note:: Currently only supports hdf5, feather and text files
 
     ======================= ===============================================
     Method                  Description        
     ======================= ===============================================
     read_hdf5               read an hdf5 file
     write_hdf5              write an hdf5 file
+    read_feather            read a feather file (needs pyarrow)
+    write_feather           write a feather file (needs pyarrow)
     write_ascii_file        write an ascii file
     read_ascii_file         read an ascii file
     ======================= ===============================================
@@ -101,7 +111,7 @@ class MT_TS(object):
     def __init__(self, **kwargs):
         
         self.station = 'mt00'
-        self._sampling_rate = 1
+        self._sampling_rate = 1.
         self._start_time_epoch_sec = 0.0
         self._start_time_utc = None
         self.component = None
@@ -123,6 +133,7 @@ class MT_TS(object):
         self.conversion = None
         self.gain = None
         self._end_header_line = 0
+        self._end_header_byte = 0
         
         self._date_time_fmt = '%Y-%m-%d %H:%M:%S.%f'
         self._attr_list = ['station',
@@ -145,6 +156,8 @@ class MT_TS(object):
                            'declination',
                            'gain',
                            'conversion']
+        # ascii headers list the attributes alphabetically
+        self._sorted_attr_list = sorted(self._attr_list)
         
         for key in list(kwargs.keys()):
             setattr(self, key, kwargs[key])
@@ -161,23 +174,26 @@ class MT_TS(object):
         """
         if setting ts with a pandas data frame, make sure the data is in a 
         column name 'data'
+        
+        A data frame that already has a time index starting at 
+        start_time_utc with a step of 1/sampling_rate keeps its index, 
+        otherwise the index is rebuilt.
         """
-        if type(ts_arr) is np.ndarray:
+        if isinstance(ts_arr, np.ndarray):
             self._ts = pd.DataFrame({'data':ts_arr})
             if self.start_time_utc is not None or \
                type(self._ts.index[0]) in ['int']:
                 self._set_dt_index(self.start_time_utc)
                 
-        elif type(ts_arr) is pd.core.frame.DataFrame:
-            try:
-                ts_arr['data']
-                self._ts = ts_arr
-                # be sure to set the index time
-                if self.start_time_utc is not None:
-                    self._set_dt_index(self.start_time_utc)
-            except AttributeError:
+        elif isinstance(ts_arr, pd.DataFrame):
+            if 'data' not in ts_arr.columns:
                 raise MT_TS_Error('Data frame needs to have a column named "data" '+\
                                    'where the time series data is stored')
+            self._ts = ts_arr
+            # be sure to set the index time
+            if self.start_time_utc is not None and \
+               not self._has_dt_index():
+                self._set_dt_index(self.start_time_utc)
         else:
             raise MT_TS_Error('Data type {0} not supported'.format(type(ts_arr))+\
                               ', ts needs to be a numpy.ndarray or pandas DataFrame')
@@ -247,15 +263,18 @@ class MT_TS(object):
         """
         try:
             sr = float(sampling_rate)
-            if self._sampling_rate == sr:
-                return
-            else:
-                self._sampling_rate = sr
-                if self.start_time_utc is not None:
-                    self._set_dt_index(self.start_time_utc)
-                
         except ValueError:
             raise MT_TS_Error("Input sampling rate should be a float not {0}".format(type(sampling_rate)))
+            
+        if self._sampling_rate == sr:
+            return
+        self._sampling_rate = sr
+        
+        # the index is built when the data are set, so nothing to do until
+        # there are data and a start time
+        if self._ts.empty or self.start_time_utc is None:
+            return
+        self._set_dt_index(self.start_time_utc)
    
     ## set time and set index
     @property
@@ -282,6 +301,9 @@ class MT_TS(object):
         dt = datetime.datetime.strptime(start_time, self._date_time_fmt)
         self._start_time_utc = datetime.datetime.strftime(dt,
                                                           self._date_time_fmt)
+        # keep epoch seconds in sync so they are not parsed on every access
+        self._start_time_epoch_sec = calendar.timegm(dt.timetuple())+\
+                                     dt.microsecond*1E-6
          
         # make a time series that the data can be indexed by
         if hasattr(self.ts, 'data'):
@@ -294,7 +316,7 @@ class MT_TS(object):
         if self.start_time_utc is None:
             return None
         else:
-            return self._convert_dt_to_sec(self.start_time_utc)
+            return self._start_time_epoch_sec
         
     @start_time_epoch_sec.setter
     def start_time_epoch_sec(self, epoch_sec):
@@ -307,11 +329,12 @@ class MT_TS(object):
         """
         
         try:
-            self._start_time_epoch_sec = float(epoch_sec)
+            epoch_sec = float(epoch_sec)
         except ValueError:
             raise MT_TS_Error("Need to input epoch_sec as a float not {0}".format(type(epoch_sec)))
         
-        dt_struct = datetime.datetime.utcfromtimestamp(self._start_time_epoch_sec)
+        # the cached epoch seconds are set by start_time_utc
+        dt_struct = datetime.datetime.utcfromtimestamp(epoch_sec)
         # these should be self cosistent
         dt_utc = datetime.datetime.strftime(dt_struct, self._date_time_fmt)
         if self.start_time_utc != dt_utc:
@@ -356,15 +379,32 @@ class MT_TS(object):
         if start_time is None:
             print('Start time is None, skipping calculating index')
             return 
-        dt_freq = '{0:.0f}N'.format(1./(self.sampling_rate)*1E9)
+        # build the index directly as nanoseconds from the start time, 
+        # this is much faster than pd.date_range for long time series
+        dt_ns = int(round(1.E9/self.sampling_rate))
+        start_ns = np.datetime64(start_time, 'ns').astype(np.int64)
+        dt_index = start_ns+np.arange(self.ts.data.size, dtype=np.int64)*dt_ns
 
-        dt_index = pd.date_range(start=start_time, 
-                                 periods=self.ts.data.size, 
-                                 freq=dt_freq)
-
-        self.ts.index = dt_index
+        self.ts.index = pd.DatetimeIndex(dt_index.view('datetime64[ns]'))
         print("   * Reset time seies index to start at {0}".format(start_time))
     
+    def _has_dt_index(self):
+        """
+        check if the time series already has a time index that starts at
+        start_time_utc with a step of 1/sampling_rate
+        
+        :returns: [ True | False ]
+        """
+        dt_index = self.ts.index
+        if not isinstance(dt_index, pd.DatetimeIndex) or dt_index.size < 2:
+            return False
+            
+        dt_ns = int(round(1.E9/self.sampling_rate))
+        start_ns = np.datetime64(self.start_time_utc, 'ns').astype(np.int64)
+        
+        return dt_index[0].value == start_ns and \
+               (dt_index[1]-dt_index[0]).value == dt_ns
+    
     # convert time to epoch seconds
     def _convert_dt_to_sec(self, date_time_str):
         """
@@ -406,9 +446,10 @@ class MT_TS(object):
                   'freqrad':freq_rad,
                   'rp':rp}
         
-        ts, filt_list = mtfilter.adaptive_notch_filter(self.ts.data, **kwargs)
+        ts, filt_list = mtfilter.adaptive_notch_filter(self.ts.data.values,
+                                                       **kwargs)
         
-        self.ts.data = ts
+        self.ts['data'] = ts
         
         print('\t Filtered frequency with bandstop:')
         for ff in filt_list:
@@ -421,7 +462,9 @@ class MT_TS(object):
     # decimate data
     def decimate(self, dec_factor=1):
         """
-        decimate the data by using scipy.signal.decimate
+        decimate the data by using scipy.signal.resample_poly, the anti-alias
+        FIR filter is applied in polyphase form so only the kept samples
+        are computed
 
         :param dec_factor: decimation factor
         :type dec_factor: int
@@ -433,8 +476,15 @@ class MT_TS(object):
         dec_factor = int(dec_factor)
         
         if dec_factor > 1:
-            self.ts = signal.decimate(self.ts.data, dec_factor, n=8)
-            self.sampling_rate /= float(dec_factor)
+            # extend the ends along a line so an offset in the data does not
+            # ring at the edges
+            ts_dec = signal.resample_poly(self.ts.data.values, 1, dec_factor,
+                                          window=('kaiser', 8.0), 
+                                          padtype='line')
+            # set the new sampling rate before the data so the time index
+            # is only built once
+            self._sampling_rate /= float(dec_factor)
+            self.ts = ts_dec
             
     def low_pass_filter(self, low_pass_freq=15, cutoff_freq=55):
         """
@@ -449,26 +499,46 @@ class MT_TS(object):
         * filters ts.data
         """
         
-        self.ts = mtfilter.low_pass(self.ts.data, 
-                                    low_pass_freq,
-                                    cutoff_freq,
-                                    self.sampling_rate)
+        # filter in place, the time index does not change
+        self.ts['data'] = mtfilter.low_pass(self.ts.data.values, 
+                                            low_pass_freq,
+                                            cutoff_freq,
+                                            self.sampling_rate)
     
     ###------------------------------------------------------------------
     ### read and write file types
-    def write_hdf5(self, fn_hdf5, compression_level=0, compression_lib='blosc'):
+    def write_hdf5(self, fn_hdf5, compression_level=5, 
+                   compression_lib='blosc:lz4', chunk_size=2**16, 
+                   dtype=None):
         """
         Write an hdf5 file with metadata using pandas to write the file.
         
+        The time series is stored in table format so it is compressed in
+        chunks and a range of rows can be read without reading the 
+        whole file.
+        
         :param fn_hdf5: full path to hdf5 file, has .h5 extension
         :type fn_hdf5: string
         
         :param compression_level: compression level of file [ 0-9 ]
+                                  *default* is 5
         :type compression_level: int
         
-        :param compression_lib: compression library *default* is blosc
+        :param compression_lib: compression library *default* is blosc:lz4
         :type compression_lib: string
         
+        :param chunk_size: number of samples handed to each write call, 
+                           this bounds the memory used while writing, the
+                           hdf5 chunk shape is chosen by PyTables from the
+                           number of samples *default* is 2**16
+        :type chunk_size: int
+        
+        :param dtype: data type to store the time series as 
+                      [ 'float64' | 'float32' | 'int32' ], use 'int32' for
+                      data still in counts to halve the file size.
+                      *default* is None, which keeps the current data type
+        :type dtype: string
+        
         :returns: fn_hdf5
         
         .. seealso:: Pandas.HDf5Store
@@ -478,24 +548,43 @@ class MT_TS(object):
                                  complevel=compression_level,
                                  complib=compression_lib)
         
-        # might want to re index because the time string takes up a lot of 
-        # storage
-        #df = pd.DataFrame({'data':self.ts.data})
-        #df.index = np.arange(df.data.size)
-        hdf5_store['time_series'] = self.ts
-        
-        # add in attributes
+        ts_df = self.ts.reset_index(drop=True)
+        if dtype is not None:
+            ts_data = self.ts.data.values.astype(dtype, copy=False)
+            if ts_data.dtype.kind in 'iu' and \
+               not np.array_equal(ts_data, self.ts.data.values):
+                hdf5_store.close()
+                raise MT_TS_Error('Cannot store data as {0} '.format(dtype)+\
+                                  'without losing precision')
+            ts_df['data'] = ts_data
+        
+        # the time index is not stored, it takes up more space than the 
+        # data and is rebuilt from start_time_utc and sampling_rate on read
+        hdf5_store.append('time_series', ts_df,
+                          format='table',
+                          chunksize=chunk_size,
+                          expectedrows=max(self.n_samples, 1))
+        
+        # add in attributes, anything that is None is left out and keeps
+        # its default value on read.  Numbers and strings are stored as 
+        # native hdf5 attributes, anything else would be pickled so it is
+        # stored as a string.
+        ts_attrs = hdf5_store.get_storer('time_series').attrs
         for attr in self._attr_list:
-            setattr(hdf5_store.get_storer('time_series').attrs, 
-                    attr,
-                    getattr(self, attr))
+            value = getattr(self, attr)
+            if value is None:
+                continue
+            if not isinstance(value, (int, float, str, np.number)):
+                value = str(value)
+            setattr(ts_attrs, attr, value)
 
         hdf5_store.flush()
         hdf5_store.close()
         
         return fn_hdf5
         
-    def read_hdf5(self, fn_hdf5, compression_level=0, compression_lib='blosc'):
+    def read_hdf5(self, fn_hdf5, compression_level=0, compression_lib='blosc',
+                  in_memory=False):
         """
         Read an hdf5 file with metadata using Pandas.
         
@@ -508,32 +597,119 @@ class MT_TS(object):
         :param compression_lib: compression library *default* is blosc
         :type compression_lib: string
         
+        :param in_memory: if True the whole file is read into memory in 
+                          one sequential read before the data are 
+                          decompressed, which is faster for large files on
+                          slow or network drives *default* is False
+        :type in_memory: [ True | False ]
+        
         :returns: fn_hdf5
         
         .. seealso:: Pandas.HDf5Store
         """
         self.fn = fn_hdf5
         
-        hdf5_store = pd.HDFStore(fn_hdf5, 'r', complib=compression_lib)
-        
-        self.ts = hdf5_store['time_series']
-        
+        store_kwargs = {}
+        if in_memory:
+            store_kwargs['driver'] = 'H5FD_CORE'
+            store_kwargs['driver_core_backing_store'] = 0
+        
+        hdf5_store = pd.HDFStore(fn_hdf5, 'r', complib=compression_lib,
+                                 **store_kwargs)
+        
+        # read directly from the storer, this skips the select machinery 
+        # that HDFStore.__getitem__ goes through for a full read
+        storer = hdf5_store.get_storer('time_series')
+        ts_df = storer.read()
+        # data stored as integer counts are promoted so they can be scaled
+        # and filtered in place
+        if ts_df.data.dtype.kind in 'iu':
+            ts_df['data'] = ts_df.data.astype(np.float64)
+        
+        # clear out any old data so setting the metadata does not reindex it
+        self._ts = pd.DataFrame()
+        ts_attrs = storer.attrs
         for attr in self._attr_list:
-            value = getattr(hdf5_store.get_storer('time_series').attrs, attr)
-            setattr(self, attr, value)
+            if attr in ts_attrs:
+                setattr(self, attr, getattr(ts_attrs, attr))
             
         hdf5_store.close()  
         
-    def write_ascii_file(self, fn_ascii, chunk_size=4096):
+        # the time index is built once from the metadata just read in
+        self.ts = ts_df
+        
+    def write_feather(self, fn_feather, compression='zstd'):
+        """
+        Write a feather file with metadata using pyarrow.  The metadata 
+        are stored in the schema of the file.
+        
+        :param fn_feather: full path to feather file, has .feather extension
+        :type fn_feather: string
+        
+        :param compression: compression [ 'zstd' | 'lz4' | 'uncompressed' ]
+                            *default* is zstd
+        :type compression: string
+        
+        :returns: fn_feather
+        
+        .. seealso:: pyarrow.feather
+        """
+        if feather is None:
+            raise MT_TS_Error('Need pyarrow to write feather files')
+            
+        # like hdf5 the time index is rebuilt from the metadata on read
+        table = pyarrow.Table.from_pandas(self.ts.reset_index(drop=True),
+                                          preserve_index=False)
+        
+        meta_dict = dict([(attr, getattr(self, attr)) 
+                          for attr in self._attr_list])
+        schema_meta = dict(table.schema.metadata or {})
+        schema_meta[b'mt_ts'] = json.dumps(meta_dict, default=str)
+        table = table.replace_schema_metadata(schema_meta)
+        
+        feather.write_feather(table, fn_feather, compression=compression)
+        
+        return fn_feather
+        
+    def read_feather(self, fn_feather):
+        """
+        Read a feather file with metadata using pyarrow.
+        
+        :param fn_feather: full path to feather file
+        :type fn_feather: string
+        
+        .. seealso:: pyarrow.feather
+        """
+        if feather is None:
+            raise MT_TS_Error('Need pyarrow to read feather files')
+            
+        self.fn = fn_feather
+        
+        table = feather.read_table(fn_feather)
+        meta_dict = json.loads(table.schema.metadata[b'mt_ts'])
+        ts_df = table.to_pandas()
+        
+        # clear out any old data so setting the metadata does not reindex it
+        self._ts = pd.DataFrame()
+        for attr in self._attr_list:
+            if meta_dict.get(attr) is not None:
+                setattr(self, attr, meta_dict[attr])
+                
+        self.ts = ts_df
+        
+    def write_ascii_file(self, fn_ascii, chunk_size=65536, fmt='%.8e'):
         """
         Write an ascii format file with metadata
         
         :param fn_ascii: full path to ascii file
         :type fn_ascii: string
         
-        :param chunk_size: read in file by chunks for efficiency
+        :param chunk_size: number of samples formatted and written at a time
         :type chunk_size: int
         
+        :param fmt: string format of each data point *default* is '%.8e'
+        :type fmt: string
+        
         :Example: ::
             
             >>> ts_obj.write_ascii_file(r"/home/ts/mt01.EX")
@@ -542,39 +718,27 @@ class MT_TS(object):
         
         st = datetime.datetime.utcnow()
 
-        # get the number of chunks to write        
-        chunks = self.ts.shape[0]/chunk_size
-            
         # make header lines
         header_lines = ['# *** MT time series text file for {0} ***'.format(self.station)]
         header_lines += ['# {0} = {1}'.format(attr, getattr(self, attr)) 
-                        for attr in sorted(self._attr_list)]
+                        for attr in self._sorted_attr_list]
+        header_lines += ['# *** time_series ***\n']
 
+        ts_data = self.ts.data.values
+        line_fmt = '{0}\n'.format(fmt)
+        
         # write to file in chunks
         with open(fn_ascii, 'w') as fid:
-            # write header lines first
+            # write header lines and time series indicator first
             fid.write('\n'.join(header_lines))
-    
-            # write time series indicator
-            fid.write('\n# *** time_series ***\n')
             
-            # write in chunks
-            for cc in range(chunks):
-                # changing the dtype of the array is faster than making
-                # a list of strings
-                ts_lines = np.array(self.ts.data[cc*chunk_size:(cc+1)*chunk_size],
-                                    dtype='S20')
+            # formatting a whole chunk with one string operation is much
+            # faster than formatting each sample, the last chunk is just
+            # shorter
+            for ii in range(0, ts_data.size, chunk_size):
+                ts_chunk = ts_data[ii:ii+chunk_size]
+                fid.write((line_fmt*ts_chunk.size) % tuple(ts_chunk))
 
-                fid.write('\n'.join(list(ts_lines)))
-                # be sure to write a new line after each chunk otherwise
-                # they run together
-                fid.write('\n')
-             
-            # be sure to write the last little bit
-            fid.write('\n'.join(list(np.array(self.ts.data[(cc+1)*chunk_size:],
-                                              dtype='S20'))))
-
-                
         # get an estimation of how long it took to write the file    
         et = datetime.datetime.utcnow()
         time_diff = et-st
@@ -598,6 +762,7 @@ class MT_TS(object):
         self.fn = fn_ascii
         
         with open(self.fn, 'r') as fid:
+            header_end = fid.tell()
             line = fid.readline()
             count = 0
             while line.find('#') == 0:
@@ -630,8 +795,10 @@ class MT_TS(object):
                         self.lon = float(line_list[7])
                         self.elev = float(line_list[8])
                 count +=1
+                header_end = fid.tell()
                 line = fid.readline()
         self._end_header_line = count
+        self._end_header_byte = header_end
 
     def read_ascii(self, fn_ascii):
         """
@@ -647,11 +814,11 @@ class MT_TS(object):
         
         self.read_ascii_header(fn_ascii)
         
-        self.ts = pd.read_csv(self.fn, 
-                              sep='\n', 
-                              skiprows=self._end_header_line,
-                              memory_map=True,
-                              names=['data'])
+        # the data are one number per line, so skip past the header and 
+        # let numpy parse the rest of the file directly
+        with open(self.fn, 'rb') as fid:
+            fid.seek(self._end_header_byte)
+            self.ts = np.fromfile(fid, dtype=np.float64, sep='\n')
         
         print('Read in {0}'.format(self.fn))
         
@@ -664,6 +831,8 @@ class MT_TS(object):
         :param spectra_type: [ 'welch' ]
         :type spectral_type: string
         
+        :returns: frequency and power arrays
+        
         :Example: ::
             
             >>> ts_obj = mtts.MT_TS()
@@ -678,7 +847,10 @@ class MT_TS(object):
             param_dict['fs'] = kwargs.pop('sampling_rate',
                                                        self.sampling_rate)
             param_dict['nperseg'] = kwargs.pop('nperseg', 2**12)
-            s.compute_spectra(self.ts.data, spectra_type, **param_dict)
+            # scipy.signal.welch already windows and FFTs all the segments
+            # as one batch, so hand it the raw array
+            return s.compute_spectra(self.ts.data.values, spectra_type, 
+                                     **param_dict)
                 
 #==============================================================================
 # Error classes
@@ -703,7 +875,7 @@ class Spectra(object):
         """
         
         if spectra_type.lower() == 'welch':
-            self.welch_method(data, **kwargs)
+            return self.welch_method(data, **kwargs)
         
     def welch_method(self, data, plot=True, **kwargs):
         """
@@ -16,6 +16,7 @@ JP
 #=================================================================
 import numpy as np
 import  os
+from functools import lru_cache
 
 import scipy.signal as signal
 
@@ -62,8 +63,10 @@ def low_pass(f, low_pass_freq, cutoff_freq, sampling_rate):
                                     cutoff_freq/nyq, 
                                     3, 40)
                                     
-    b, a = signal.butter(filt_order, wn, btype='low')
-    f_filt = signal.filtfilt(b, a, f)
+    # second order sections are faster and more stable than (b, a) for
+    # the high filter orders buttord can return
+    sos = signal.butter(filt_order, wn, btype='low', output='sos')
+    f_filt = signal.sosfiltfilt(sos, f)
     
     return f_filt
 
@@ -145,6 +148,20 @@ def zero_pad(input_array, power=2, pad_fill=0):
     
     
 
+@lru_cache(maxsize=128)
+def _design_notch(df, f_notch, notch_radius):
+    """
+    design a Chebyshev type 1 bandstop filter as second order sections that
+    stops notch_radius around f_notch.  The band edges cheb1ord returns do 
+    not depend on the stop band attenuation, so the filter only depends on
+    the arguments and is designed once for all time series that share them.
+    Do not change the returned array in place, it is cached.
+    """
+    ws = 2*np.array([f_notch-notch_radius, f_notch+notch_radius])/df
+    wp = 2*np.array([f_notch-2*notch_radius, f_notch+2*notch_radius])/df
+    ford, wn = signal.cheb1ord(wp, ws, 1, 40)
+    return signal.cheby1(1, .5, wn, btype='bandstop', output='sos')
+
 def adaptive_notch_filter(bx, df=100, notches=[50, 100], notchradius=.5, 
                           freqrad=.9, rp=.1, dbstop_limit=5.0):
     """
@@ -232,45 +249,49 @@ def adaptive_notch_filter(bx, df=100, notches=[50, 100], notchradius=.5,
     if type(notches) is list:
         notches = np.array(notches)
     elif type(notches) in [float, int]:
-        notches = np.array([notches], dtype=np.float)
+        notches = np.array([notches], dtype=np.float64)
     
     df = float(df)         #make sure df is a float
     dt = 1./df             #sampling rate
 
 
-    # transform data into frequency domain to find notches
-    BX = np.fft.fft(zero_pad(bx))
-    n = len(BX)            #length of array
+    # transform data into frequency domain to find notches, the data are 
+    # real so only the positive frequencies are needed
+    n = zero_pad(bx).shape[0]   #length of padded array
+    BX = abs(np.fft.rfft(bx, n))
+    nf = len(BX)           #number of positive frequencies
     dfn = df/n             #frequency step
     dfnn = int(freqrad/dfn)          #radius of frequency search
     fn = notchradius               #filter radius
-    freq = np.fft.fftfreq(n,dt)
+    freq = np.fft.rfftfreq(n, dt)
     
     filtlst = []
+    sos_list = []
     for notch in notches:
         if notch > freq.max():
             break
             #print 'Frequency too high, skipping {0}'.format(notch)
         else:
             fspot = int(round(notch/dfn))
-            nspot = np.where(abs(BX)== max(abs(BX[max([fspot-dfnn, 0]):\
-                                                 min([fspot+dfnn, n])])))[0][0]   
+            f_min = max([fspot-dfnn, 0])
+            nspot = f_min+np.argmax(BX[f_min:min([fspot+dfnn, nf])])
 
-            med_bx =np.median(abs(BX[max([nspot-dfnn*10, 0]):\
-                                     min([nspot+dfnn*10, n])])**2)
+            med_bx =np.median(BX[max([nspot-dfnn*10, 0]):\
+                                 min([nspot+dfnn*10, nf])]**2)
             
             #calculate difference between peak and surrounding spectra in dB
-            dbstop = 10*np.log10(abs(BX[nspot])**2/med_bx) 
+            dbstop = 10*np.log10(BX[nspot]**2/med_bx) 
             if np.nan_to_num(dbstop) == 0.0 or dbstop < dbstop_limit:
                 filtlst.append('No need to filter \n')
                 pass
             else:
                 filtlst.append([freq[nspot], dbstop])
-                ws = 2*np.array([freq[nspot]-fn, freq[nspot]+fn])/df
-                wp = 2*np.array([freq[nspot]-2*fn, freq[nspot]+2*fn])/df
-                ford, wn = signal.cheb1ord(wp, ws, 1, dbstop)
-                b, a = signal.cheby1(1, .5, wn, btype='bandstop')
-                bx = signal.filtfilt(b, a, bx)
+                sos_list.append(_design_notch(df, freq[nspot], fn))
+    
+    # the notches are designed from the original spectra, so they can be
+    # applied as one cascade of second order sections in a single pass
+    if len(sos_list) > 0:
+        bx = signal.sosfiltfilt(np.vstack(sos_list), bx)
     
     return bx, filtlst
 
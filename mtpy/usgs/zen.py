@@ -16,13 +16,26 @@ Created on Tue Jun 11 10:53:23 2013
 
 #==============================================================================
 import time
+import calendar
 import datetime
 import os
-import struct
+import io
+import sys
+import re
+import math
 import string
 import shutil
+import ctypes
+import mmap
+import contextlib
+import operator
+import threading
+import json
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache, partial
 
 import numpy as np
+import pandas as pd
 import scipy.signal as sps
 
 import matplotlib.pyplot as plt
@@ -41,6 +54,493 @@ except ImportError:
 #==============================================================================
 datetime_fmt = '%Y-%m-%d,%H:%M:%S'
 datetime_sec = '%Y-%m-%d %H:%M:%S'
+# start of gps time, 1980-01-06 00:00:00 UTC, in seconds from the unix epoch
+gps_epoch_seconds = calendar.timegm((1980, 1, 6, 0, 0, 0, -1, -1, 0))
+# header + schedule + first metadata block
+prologue_len = 1536
+# folder next to the Z3D files that holds their parsed headers
+_z3d_cache_dir = '.z3d_cache'
+# version of the files in _z3d_cache_dir, change it when what is kept changes
+_z3d_cache_version = 1
+# read a block at an offset in one system call where the os supports it
+_has_pread = hasattr(os, 'pread')
+# key = value lines of the header and schedule, the schedule keys are
+# prefixed with Schedule. so only keep what comes after the first .
+# Keys cannot hold the \x00 padding at the end of a block, otherwise every
+# padding byte starts a key that runs to the end of the block and fails.
+_header_re = re.compile(b'([^=\n\x00]+)=([^\n]*)')
+_schedule_re = re.compile(b'[^.=\n\x00]*\.([^.=\n\x00]+)'
+                          b'[^=\n\x00]*=([^\n]*)')
+# lines of a zen schedule .cfg file that are read back, the first word and
+# the value after the first space
+_schedule_cfg_re = re.compile(r'^(scheduleaction|METADATA|offset|\w+Light)\S*'
+                              r' ([^ \n]*)', re.M)
+# keys are lower cased with ' ' and '.' made '_' in one translate, the 
+# header also drops '/'
+_upper = string.ascii_uppercase.encode('ascii')
+_lower = string.ascii_lowercase.encode('ascii')
+_header_key_table = bytes.maketrans(b' .'+_upper, b'__'+_lower)
+_metadata_key_table = bytes.maketrans(b'.'+_upper, b'_'+_lower)
+# attribute names already made from raw keys, keys repeat from file to
+# file so each one is normalized once, the size is capped in case of junk
+_header_key_cache = {}
+_schedule_key_cache = {}
+_metadata_key_cache = {}
+_key_cache_len = 1024
+# rx.xyz0 entry of a | separated metadata record, holds the station number
+_rx_xyz0_re = re.compile(br'(?:^|\|)\s*rx\.xyz0\s*=([^|\n]*)', 
+                         re.IGNORECASE | re.MULTILINE)
+# calibration records
+_cal_record_re = re.compile(br'cal\.brd|cal\.ant')
+# calibration entries, numbers separated by :
+_cal_number = br'\s*[-+]?(?:(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|inf|nan)\s*'
+_cal_re = re.compile(b'(?:' + _cal_number + b':)*' + _cal_number,
+                     re.IGNORECASE)
+_board_cal_dtype = np.dtype([('frequency', np.float64),
+                             ('rate', np.float64),
+                             ('amplitude', np.float64),
+                             ('phase', np.float64)])
+_coil_cal_dtype = np.dtype([('frequency', np.float64),
+                            ('amplitude', np.float64),
+                            ('phase', np.float64)])
+#==============================================================================
+def read_prologue(fid):
+    """
+    read the header, schedule and first metadata block of a Z3D file in one
+    read, so the parsers can slice it instead of each doing a seek and read.
+    
+    Arguments
+    ------------
+        **fid** : file object
+                  ie. open(Z3D_file, 'rb') or a map from mmap_open
+                  
+    Returns
+    ------------
+        **prologue** : string
+                       first prologue_len bytes of the file
+                       
+    Example
+    --------------
+        >>> import mtpy.usgs.zen as zen
+        >>> z3d_fn = r"/home/mt/mt01/mt01_20150522_080000_256_EX.Z3D"
+        >>> with open(z3d_fn, 'rb') as fid:
+        >>> ... prologue = zen.read_prologue(fid)
+        >>> ... header_obj = zen.Z3D_Header()
+        >>> ... header_obj.read_header(fid=fid, prebuf=prologue)
+    """
+    return _read_block(fid, prologue_len, 0)
+    
+@contextlib.contextmanager
+def mmap_open(fn):
+    """
+    memory map a Z3D file read only.  The map can be given as fid to the
+    read methods, blocks are then sliced out of the map without any
+    system calls and the os pages the file in as it is touched.
+    
+    Arguments
+    ------------
+        **fn** : string
+                 full path to Z3D file
+                 
+    Example
+    --------------
+        >>> import mtpy.usgs.zen as zen
+        >>> z3d_fn = r"/home/mt/mt01/mt01_20150522_080000_256_EX.Z3D"
+        >>> with zen.mmap_open(z3d_fn) as z3d_map:
+        >>> ... metadata_obj = zen.Z3D_Metadata()
+        >>> ... metadata_obj.read_metadata(fid=z3d_map)
+    """
+    # the map stays valid once the file is closed
+    with open(fn, 'rb') as fid:
+        z3d_map = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield z3d_map
+    finally:
+        z3d_map.close()
+    
+def _key_name(key, key_table, key_cache, delete=b''):
+    """
+    make an attribute name from a raw key of a Z3D file.  The name is 
+    interned and cached, so every distinct key is only normalized once
+    and set as the same string object on every instance.
+    """
+    try:
+        return key_cache[key]
+    except KeyError:
+        name = sys.intern(key.strip().translate(key_table, 
+                                                delete).decode('ascii'))
+        if len(key_cache) < _key_cache_len:
+            key_cache[key] = name
+        return name
+    
+def _read_block(fid, n_bytes, offset):
+    """
+    read n_bytes of fid starting at offset.  If fid is a memory map the
+    block is sliced from it, if fid is backed by a file descriptor this is 
+    a single os.pread, neither moves the file position, otherwise it is a
+    seek and a read.
+    """
+    if isinstance(fid, mmap.mmap):
+        return fid[offset:offset+n_bytes]
+    if _has_pread:
+        try:
+            return os.pread(fid.fileno(), n_bytes, offset)
+        except (AttributeError, io.UnsupportedOperation):
+            pass
+    fid.seek(offset)
+    return fid.read(n_bytes)
+    
+def _read_prologue_fn(fn):
+    """
+    open a Z3D file and read its prologue
+    """
+    with open(fn, 'rb') as fid:
+        return read_prologue(fid)
+    
+def batch_read_prologues(fn_list, workers=16):
+    """
+    read the prologue of many Z3D files at once.  The reads are spread over
+    a pool of threads, which overlaps the open/read/close of each file
+    since the GIL is released while waiting on the disk.
+    
+    Arguments
+    ------------
+        **fn_list** : list
+                      list of full paths to Z3D files
+                      
+        **workers** : int
+                      number of threads to read with *default* is 16
+                      
+    Returns
+    ------------
+        **prologue_dict** : dictionary
+                            keys are the file names and values are the 
+                            prologue of each file, pass these to the 
+                            read methods as prebuf
+                            
+    Example
+    --------------
+        >>> import mtpy.usgs.zen as zen
+        >>> import glob
+        >>> fn_list = glob.glob(r"/home/mt/mt01/*.Z3D")
+        >>> prologue_dict = zen.batch_read_prologues(fn_list)
+        >>> header_obj = zen.Z3D_Header()
+        >>> header_obj.read_header(prebuf=prologue_dict[fn_list[0]])
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        prologue_list = list(executor.map(_read_prologue_fn, fn_list))
+        
+    return dict(zip(fn_list, prologue_list))
+    
+def _read_header_fn(fn):
+    """
+    read just the header of a Z3D file into a Z3D_Header
+    """
+    header_obj = Z3D_Header(fn=fn)
+    with open(fn, 'rb', buffering=0) as fid:
+        header_obj.read_header(fid=fid)
+    return header_obj
+    
+def read_headers_parallel(fn_list, workers=16):
+    """
+    read the headers of many Z3D files at once.  Each file is a single 
+    open and read of the header block on a pool of threads.
+    
+    Arguments
+    ------------
+        **fn_list** : list
+                      list of full paths to Z3D files
+                      
+        **workers** : int
+                      number of threads to read with *default* is 16
+                      
+    Returns
+    ------------
+        **header_list** : list
+                          list of Z3D_Header objects in the same order as 
+                          fn_list
+                          
+    Example
+    --------------
+        >>> import mtpy.usgs.zen as zen
+        >>> import glob
+        >>> fn_list = glob.glob(r"/home/mt/mt01/*.Z3D")
+        >>> header_list = zen.read_headers_parallel(fn_list)
+        >>> df_list = [header_obj.ad_rate for header_obj in header_list]
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_read_header_fn, fn_list))
+    
+def _read_z3d_fn(fn):
+    """
+    read a whole Z3D file into a Zen3D object
+    """
+    z3d_obj = Zen3D(fn=fn)
+    z3d_obj.read_z3d()
+    _drop_file_refs(z3d_obj)
+    return z3d_obj
+    
+def _drop_file_refs(z3d_obj):
+    """
+    the readers keep the closed file or map they read from, which cannot be
+    pickled and is of no further use, so let go of it
+    """
+    for info_obj in [z3d_obj.header, z3d_obj.schedule, z3d_obj.metadata]:
+        info_obj.fid = None
+        
+def read_z3d_info(fn, fn_stat=None, info_cache=None):
+    """
+    read just the header, schedule and metadata of a Z3D file.  If 
+    info_cache is given the information is kept in it by path, modified 
+    time and size, so walking the same files again with the same 
+    info_cache does not read them again.
+    
+    Arguments
+    ------------
+        **fn** : string
+                 full path to Z3D file
+                 
+        **fn_stat** : os.stat_result
+                      stat of fn if already known, *default* is None
+                      
+        **info_cache** : dictionary
+                         Zen3D objects already read, owned by the caller.
+                         *default* is None, the file is always read
+                      
+    Returns
+    ------------
+        **z3d_obj** : Zen3D
+                      with header, schedule and metadata filled
+                      
+    Example
+    --------------
+        >>> import mtpy.usgs.zen as zen
+        >>> z3d_obj = zen.read_z3d_info(r"/home/mt/mt01/mt01_20150522_080000_256_EX.Z3D")
+        >>> z3d_obj.schedule.Date
+    """
+    if info_cache is not None:
+        if fn_stat is None:
+            fn_stat = os.stat(fn)
+        cache_key = (fn, fn_stat.st_mtime_ns, fn_stat.st_size)
+        if cache_key in info_cache:
+            return info_cache[cache_key]
+        
+    z3d_obj = Zen3D(fn=fn)
+    z3d_obj.read_all_info()
+    _drop_file_refs(z3d_obj)
+    if info_cache is not None:
+        info_cache[cache_key] = z3d_obj
+    return z3d_obj
+    
+# raw text and calibration tables are kept in a .z3d_cache file as text and
+# lists, everything else the header, schedule and metadata parse to is
+# already a string or number
+_z3d_cache_text_keys = ('header_str', 'meta_string')
+_z3d_cache_cal_dtypes = {'board_cal':_board_cal_dtype, 
+                         'coil_cal':_coil_cal_dtype}
+
+def _info_to_json(info_obj):
+    """
+    the parsed values of a header, schedule or metadata object as a 
+    dictionary that can be written with json
+    """
+    info_dict = {}
+    for key, value in info_obj.__dict__.items():
+        if key in ('fn', 'fid'):
+            continue
+        if isinstance(value, bytes):
+            value = value.decode('latin-1')
+        elif isinstance(value, np.ndarray):
+            value = value.tolist()
+        info_dict[key] = value
+    return info_dict
+    
+def _info_from_json(info_obj, info_dict):
+    """
+    set the parsed values written by _info_to_json back on info_obj
+    """
+    for key in _z3d_cache_text_keys:
+        if info_dict.get(key) is not None:
+            info_dict[key] = info_dict[key].encode('latin-1')
+    for key, cal_dtype in _z3d_cache_cal_dtypes.items():
+        if info_dict.get(key) is not None:
+            info_dict[key] = np.array([tuple(cal) for cal in info_dict[key]],
+                                      dtype=cal_dtype).view(np.recarray)
+    info_obj.__dict__.update(info_dict)
+    
+def _load_z3d_cache(fn, cache_fn, cache_key):
+    """
+    make a Zen3D of fn from its .z3d_cache file, None if there is no cache
+    for cache_key or it can not be read
+    """
+    z3d_obj = Zen3D(fn=fn)
+    try:
+        with open(cache_fn, 'r') as fid:
+            cache_dict = json.load(fid)
+        if cache_dict['key'] != cache_key:
+            return None
+        _info_from_json(z3d_obj.header, cache_dict['header'])
+        _info_from_json(z3d_obj.schedule, cache_dict['schedule'])
+        _info_from_json(z3d_obj.metadata, cache_dict['metadata'])
+    # whatever is wrong with the cache the file is just parsed again
+    except Exception:
+        return None
+    
+    z3d_obj.df = z3d_obj.header.ad_rate
+    z3d_obj.zen_schedule = '{0},{1}'.format(z3d_obj.schedule.Date,
+                                            z3d_obj.schedule.Time)
+    z3d_obj._info_fn = fn
+    return z3d_obj
+
+def _load_or_parse_z3d(fn, fn_stat=None):
+    """
+    make a Zen3D of fn with the header, schedule and metadata filled.  The
+    parsed values are kept as json in the .z3d_cache folder next to the 
+    file, keyed by the cache version, size and modified time, so processing
+    a station folder again does not parse the headers again.
+    """
+    if fn_stat is None:
+        fn_stat = os.stat(fn)
+    cache_key = [_z3d_cache_version, fn_stat.st_size, fn_stat.st_mtime_ns]
+    cache_fn = os.path.join(os.path.dirname(fn), _z3d_cache_dir, 
+                            '{0}.json'.format(os.path.basename(fn)))
+    
+    z3d_obj = _load_z3d_cache(fn, cache_fn, cache_key)
+    if z3d_obj is not None:
+        return z3d_obj
+        
+    z3d_obj = Zen3D(fn=fn)
+    z3d_obj.read_all_info()
+    _drop_file_refs(z3d_obj)
+    cache_dict = {'key':cache_key,
+                  'header':_info_to_json(z3d_obj.header),
+                  'schedule':_info_to_json(z3d_obj.schedule),
+                  'metadata':_info_to_json(z3d_obj.metadata)}
+    # write to a temporary file first so a reader never sees half a cache
+    try:
+        os.makedirs(os.path.dirname(cache_fn), exist_ok=True)
+        tmp_fn = '{0}.{1}.tmp'.format(cache_fn, os.getpid())
+        with open(tmp_fn, 'w') as fid:
+            json.dump(cache_dict, fid)
+        os.replace(tmp_fn, cache_fn)
+    except OSError:
+        pass
+    return z3d_obj
+    
+def read_z3d_batch(fn_list, workers=None):
+    """
+    read many Z3D files at once, each file is read by Zen3D.read_z3d in its
+    own process.  The Zen3D objects are pickled back to the calling 
+    process, so on Windows call this from under 
+    if __name__ == '__main__':
+    
+    Arguments
+    ------------
+        **fn_list** : list
+                      list of full paths to Z3D files
+                      
+        **workers** : int
+                      number of processes to read with *default* is None,
+                      which is the number of processors on the machine
+                      
+    Returns
+    ------------
+        **z3d_list** : list
+                       list of Zen3D objects in the same order as fn_list
+                          
+    Example
+    --------------
+        >>> import mtpy.usgs.zen as zen
+        >>> import glob
+        >>> fn_list = glob.glob(r"/home/mt/mt01/*.Z3D")
+        >>> z3d_list = zen.read_z3d_batch(fn_list, workers=4)
+        >>> ts_list = [z3d_obj.ts_obj for z3d_obj in z3d_list]
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_read_z3d_fn, fn_list))
+    
+def _read_rx_xyz0(fn):
+    """
+    read rx.xyz0 from the first metadata block of a Z3D file without making
+    a Zen3D, None if it is not in that block
+    """
+    with open(fn, 'rb', buffering=0) as fid:
+        m_block = _read_block(fid, 512, prologue_len-512)
+    rx_xyz0_find = _rx_xyz0_re.search(m_block)
+    if rx_xyz0_find is None:
+        return None
+    return rx_xyz0_find.group(1).strip().decode('ascii', 'ignore')
+    
+def _metadata_record_tag(record):
+    """
+    tag a lower cased metadata record line by its type, b'|' for a record
+    of key=value entries, b'cal.brd' and b'cal.ant' for the board and coil
+    calibrations and None for anything else.
+    """
+    if record.count(b'|') > 1:
+        return b'|'
+    cal_match = _cal_record_re.search(record)
+    if cal_match is None:
+        return None
+    return cal_match.group()
+    
+def _parse_cal(cal_str, n_entries, cal_dtype):
+    """
+    parse n_entries calibration entries, each one 'value:value:...' and 
+    joined by ':', in one pass into a record array with a field for each
+    value.  Returns None if the entries are not all numbers or do not fit
+    the fields of cal_dtype.
+    """
+    cal_str = bytes(cal_str)
+    if cal_str.count(b':')+1 != n_entries*len(cal_dtype.names):
+        return None
+    
+    # check the text up front, numpy only warns on unparsable text and
+    # catching that would mean changing the global warning filters
+    if _cal_re.fullmatch(cal_str) is None:
+        return None
+        
+    cal_arr = np.fromstring(cal_str, dtype=np.float64, sep=':')
+    return cal_arr.view(cal_dtype).view(np.recarray)
+    
+def _write_text_fn(fn, text):
+    """
+    write text to a file in one go
+    """
+    with open(fn, 'w') as fid:
+        fid.write(text)
+        
+def _write_text_files(fn_list, text_list):
+    """
+    write each text to its file on a pool of threads, one thread per file
+    """
+    if len(fn_list) == 0:
+        return
+    with ThreadPoolExecutor(max_workers=len(fn_list)) as executor:
+        # list pulls the results so a failed write raises here
+        list(executor.map(_write_text_fn, fn_list, text_list))
+    
+@lru_cache(maxsize=256)
+def _parse_date_time(date_time, dt_format):
+    """
+    parse a date and time string into a datetime.datetime, the same few
+    strings are parsed over and over when making schedules
+    """
+    return datetime.datetime.strptime(date_time, dt_format)
+    
+def _find_gps_flags(data, gps_flag):
+    """
+    find the index of every gps stamp in the int32 data.  The two flags of 
+    a stamp are compared as one int64 word, gps_flag, so the data is viewed 
+    as int64 twice, once from an even and once from an odd int32 word.
+    """
+    n_even = data.size//2
+    n_odd = (data.size-1)//2
+    even_find = np.where(data[0:2*n_even].view('<i8') == gps_flag)[0]
+    odd_find = np.where(data[1:2*n_odd+1].view('<i8') == gps_flag)[0]
+    
+    return np.sort(np.concatenate((2*even_find, 2*odd_find+1)))
+    
 #==============================================================================
 # 
 #==============================================================================
@@ -102,6 +602,13 @@ class Z3D_Header(object):
     
     """
     
+    # every header entry that is set from the file
+    _attr_list = ('ad_gain', 'ad_rate', 'alt', 'attenchannelsmask',
+                  'box_number', 'box_serial', 'channel', 'channelserial',
+                  'duty', 'fpga_buildnum', 'gpsweek', 'lat', 'logterminal',
+                  'long', 'main_hex_buildnum', 'numsats', 'period', 'tx_duty',
+                  'tx_freq', 'version')
+    
     def __init__(self, fn=None, fid=None, **kwargs):
         self.fn = fn
         self.fid = fid
@@ -109,33 +616,37 @@ class Z3D_Header(object):
         self.header_str = None
         self._header_len = 512
         
-        self.ad_gain = None
-        self.ad_rate = None
-        self.alt = None
-        self.attenchannelsmask = None
-        self.box_number = None
-        self.box_serial = None
-        self.channel = None
-        self.channelserial = None
-        self.duty = None
-        self.fpga_buildnum = None
+        for key in self._attr_list:
+            setattr(self, key, None)
         self.gpsweek = 1740
-        self.lat = None
-        self.logterminal = None
-        self.long = None
-        self.main_hex_buildnum = None
-        self.numsats = None
-        self.period = None
-        self.tx_duty = None
-        self.tx_freq = None
-        self.version = None 
         
         for key in kwargs:
             setattr(self, key, kwargs[key])
     
-    def read_header(self, fn=None, fid=None):
+    @classmethod
+    def from_buffer(cls, buf):
+        """
+        make a Z3D_Header from the start of a Z3D file that is already in
+        memory, ie. the prologue from read_prologue or batch_read_prologues,
+        without a file object.
+        
+        Example
+        --------------
+            >>> import mtpy.usgs.zen as zen
+            >>> prologue_dict = zen.batch_read_prologues(fn_list)
+            >>> header_list = [zen.Z3D_Header.from_buffer(prologue_dict[fn])
+            >>> ...                for fn in fn_list]
+        """
+        header_obj = cls()
+        header_obj.read_header(prebuf=buf)
+        return header_obj
+        
+    def read_header(self, fn=None, fid=None, prebuf=None):
         """
         read in the header string
+        
+        if prebuf is given it is the prologue returned by read_prologue and
+        the header is sliced from it instead of read from the file.
         """
         if fn is not None:
             self.fn = fn
@@ -143,28 +654,23 @@ class Z3D_Header(object):
         if fid is not None:
             self.fid = fid
 
-        if self.fn is None and self.fid is None:
+        if prebuf is not None:
+            self.header_str = prebuf[0:self._header_len]
+        elif self.fn is None and self.fid is None:
             print('no file to read')
-        elif self.fn is None:
-            if self.fid is not None:
-                self.fid.seek(0)
-                self.header_str = self.fid.read(self._header_len)
-        elif self.fn is not None:
+        else:
             if self.fid is None:
-                self.fid = file(self.fn, 'rb')
-                self.header_str = self.fid.read(self._header_len)
-            else:
-                self.fid.seek(0)
-                self.header_str = self.fid.read(self._header_len)
-
-        header_list = self.header_str.split('\n')
-        for h_str in header_list:
-            if h_str.find('=') > 0:
-                h_list = h_str.split('=')
-                h_key = h_list[0].strip().lower()
-                h_key = h_key.replace(' ', '_').replace('/', '').replace('.', '_')
-                h_value = self.convert_value(h_key, h_list[1].strip())
-                setattr(self, h_key, h_value)
+                self.fid = open(self.fn, 'rb', buffering=0)
+            self.header_str = _read_block(self.fid, self._header_len, 0)
+
+        # collect the entries and set them all at once
+        header_dict = {}
+        for h_key, h_value in _header_re.findall(self.header_str):
+            h_key = _key_name(h_key, _header_key_table, _header_key_cache,
+                              b'/')
+            h_value = h_value.strip(b' \t\r\x00').decode('ascii', 'ignore')
+            header_dict[h_key] = self.convert_value(h_key, h_value)
+        self.__dict__.update(header_dict)
 
     def convert_value(self, key_string, value_string):
         """
@@ -176,8 +682,8 @@ class Z3D_Header(object):
         except ValueError:
             return_value = value_string
         
-        if key_string.lower() == 'lat' or key_string.lower() == 'long':
-            return_value = np.rad2deg(float(value_string))
+        if key_string.lower() in ('lat', 'long'):
+            return_value = math.degrees(float(value_string))
             
         return return_value
             
@@ -241,6 +747,12 @@ class Z3D_Schedule_metadata(object):
         >>> header_obj = zen.Z3d_Schedule_metadata()
         >>> header_obj.read_schedule_metadata()
     """
+    
+    # every schedule entry that is set from the file
+    _attr_list = ('AutoGain', 'Comment', 'Date', 'Duty', 'FFTStacks',
+                  'Filename', 'Gain', 'Log', 'NewFile', 'Period', 'RadioOn',
+                  'SR', 'SamplesPerAcq', 'Sleep', 'Sync', 'Time')
+
     def __init__(self, fn=None, fid=None, **kwargs):
         self.fn = fn
         self.fid = None
@@ -249,30 +761,30 @@ class Z3D_Schedule_metadata(object):
         self._schedule_metadata_len = 512
         self._header_len = 512 
         
-        self.AutoGain = None
-        self.Comment = None
-        self.Date = None
-        self.Duty = None
-        self.FFTStacks  = None
-        self.Filename = None
-        self.Gain = None
-        self.Log = None
-        self.NewFile = None
-        self.Period = None
-        self.RadioOn = None
-        self.SR = None
-        self.SamplesPerAcq = None
-        self.Sleep = None
-        self.Sync = None
-        self.Time = None
+        for key in self._attr_list:
+            setattr(self, key, None)
         
         for key in kwargs:
             setattr(self, key, kwargs[key])
 
             
-    def read_schedule_metadata(self, fn=None, fid=None):
+    @classmethod
+    def from_buffer(cls, buf):
+        """
+        make a Z3D_Schedule_metadata from the start of a Z3D file that is 
+        already in memory, ie. the prologue from read_prologue or 
+        batch_read_prologues, without a file object.
+        """
+        schedule_obj = cls()
+        schedule_obj.read_schedule_metadata(prebuf=buf)
+        return schedule_obj
+            
+    def read_schedule_metadata(self, fn=None, fid=None, prebuf=None):
         """
         read meta data string
+        
+        if prebuf is given it is the prologue returned by read_prologue and
+        the schedule is sliced from it instead of read from the file.
         """
         if fn is not None:
             self.fn = fn
@@ -280,33 +792,38 @@ class Z3D_Schedule_metadata(object):
         if fid is not None:
             self.fid = fid
 
-        if self.fn is None and self.fid is None:
+        if prebuf is not None:
+            self.meta_string = prebuf[self._header_len:
+                                      self._header_len+\
+                                      self._schedule_metadata_len]
+        elif self.fn is None and self.fid is None:
             print('no file to read')
-        elif self.fn is None:
-            if self.fid is not None:
-                self.fid.seek(self._header_len)
-                self.meta_string = self.fid.read(self._header_len)
-        elif self.fn is not None:
+        else:
             if self.fid is None:
-                self.fid = file(self.fn, 'rb')
-                self.fid.seek(self._header_len)
-                self.meta_string = self.fid.read(self._header_len)
-            else:
-                self.fid.seek(self._header_len)
-                self.meta_string = self.fid.read(self._header_len)
+                self.fid = open(self.fn, 'rb', buffering=0)
+            self.meta_string = _read_block(self.fid,
+                                           self._schedule_metadata_len,
+                                           self._header_len)
  
-        meta_list = self.meta_string.split('\n')
-        for m_str in meta_list:
-            if m_str.find('=') > 0:
-                m_list = m_str.split('=')
-                m_key = m_list[0].split('.')[1].strip()
-                m_key = m_key.replace('/', '')
-                m_value = m_list[1].strip()
-                setattr(self, m_key, m_value)
+        # collect the entries and set them all at once
+        schedule_dict = {}
+        for m_key, m_value in _schedule_re.findall(self.meta_string):
+            m_key = _key_name(m_key, None, _schedule_key_cache, b'/')
+            m_value = m_value.strip(b' \t\r\x00').decode('ascii', 'ignore')
+            schedule_dict[m_key] = m_value
+        self.__dict__.update(schedule_dict)
                 
         # the first good GPS stamp is on the 3rd, so need to add 2 seconds
-        self.Time = '{0}{1:02}'.format(self.Time[0:6],
-                                    int(self.Time[6:])+2)
+        seconds = int(self.Time[6:8])+2
+        if seconds < 60:
+            self.Time = '{0}{1:02}'.format(self.Time[0:6], seconds)
+        else:
+            # carry into the minute, hour and possibly the date
+            start = datetime.datetime.strptime('{0},{1}'.format(self.Date,
+                                                               self.Time),
+                                               datetime_fmt)
+            start += datetime.timedelta(seconds=2)
+            self.Date, self.Time = start.strftime(datetime_fmt).split(',')
 #==============================================================================
 #  Meta data class    
 #==============================================================================
@@ -330,7 +847,9 @@ class Z3D_Metadata(object):
     _header_length           length of header in bits (512)  
     _metadata_length         length of metadata blocks (512) 
     _schedule_metadata_len   length of schedule meta data (512)
-    board_cal                board calibration np.ndarray()
+    board_cal                board calibration np.recarray with fields
+                             (frequency, rate, amplitude, phase), a view
+                             of the parsed values, None if there is none
     cal_ant                  antenna calibration
     cal_board                board calibration
     cal_ver                  calibration version
@@ -340,7 +859,9 @@ class Z3D_Metadata(object):
     ch_number                channel number on the ZEN board
     ch_xyz1                  channel xyz location (not sure)
     ch_xyz2                  channel xyz location (not sure)
-    coil_cal                 coil calibration np.ndarray (freq, amp, phase)
+    coil_cal                 coil calibration np.recarray with fields
+                             (frequency, amplitude, phase), a view of the
+                             parsed values, None if there is none
     fid                      file object
     find_metadata            boolean of finding metadata
     fn                       full path to Z3D file
@@ -378,6 +899,14 @@ class Z3D_Metadata(object):
     
     
     """
+    
+    # every metadata entry that is set from the file and the station name
+    _attr_list = ('cal_ant', 'cal_board', 'cal_ver', 'ch_azimuth', 'ch_cmp',
+                  'ch_length', 'ch_number', 'ch_xyz1', 'ch_xyz2',
+                  'gdp_operator', 'gdp_progver', 'job_by', 'job_for',
+                  'job_name', 'job_number', 'rx_aspace', 'rx_sspace',
+                  'rx_xazimuth', 'rx_xyz0', 'rx_yazimuth', 'line_name',
+                  'survey_type', 'unit_length', 'station')
 
     def __init__(self, fn=None, fid=None, **kwargs):
         self.fn = fn
@@ -390,37 +919,33 @@ class Z3D_Metadata(object):
         self._schedule_metadata_len = 512
         self.m_tell = 0
         
-        self.cal_ant = None
-        self.cal_board = None
-        self.cal_ver = None
-        self.ch_azimuth = None
-        self.ch_cmp = None
-        self.ch_length = None
-        self.ch_number = None
-        self.ch_xyz1 = None
-        self.ch_xyz2 = None
-        self.gdp_operator = None
-        self.gdp_progver = None
-        self.job_by = None
-        self.job_for = None
-        self.job_name = None
-        self.job_number = None
-        self.rx_aspace = None
-        self.rx_sspace = None
-        self.rx_xazimuth = None
-        self.rx_xyz0 = None
-        self.rx_yazimuth = None
-        self.line_name = None
-        self.survey_type = None
-        self.unit_length = None
-        self.station = None
+        for key in self._attr_list:
+            setattr(self, key, None)
 
         for key in kwargs:
             setattr(self, key, kwargs[key])
 
-    def read_metadata(self, fn=None, fid=None):
+    @classmethod
+    def from_buffer(cls, buf, fid=None):
+        """
+        make a Z3D_Metadata from the start of a Z3D file that is already in
+        memory, ie. the prologue from read_prologue or batch_read_prologues.
+        
+        buf should hold all the metadata blocks, if it does not the rest 
+        are read from fid, or if fid is None the metadata stops at the end
+        of buf.
+        """
+        metadata_obj = cls()
+        metadata_obj.read_metadata(fid=fid, prebuf=buf)
+        return metadata_obj
+
+    def read_metadata(self, fn=None, fid=None, prebuf=None):
         """
         read meta data
+        
+        if prebuf is given it holds the start of the file, ie. the prologue
+        returned by read_prologue.  The metadata blocks it contains are 
+        sliced from it and any further blocks are read from the file.
         """
         if fn is not None:
             self.fn = fn
@@ -429,108 +954,126 @@ class Z3D_Metadata(object):
             self.fid = fid
 
         if self.fn is None and self.fid is None:
-            print('no file to read')
-        elif self.fn is None:
-            if self.fid is not None:
-                self.fid.seek(self._header_length+self._schedule_metadata_len)
-        elif self.fn is not None:
-            if self.fid is None:
-                self.fid = file(self.fn, 'rb')
-                self.fid.seek(self._header_length+self._schedule_metadata_len)
-            else:
-                self.fid.seek(self._header_length+self._schedule_metadata_len)
+            if prebuf is None:
+                print('no file to read')
+        elif self.fid is None:
+            self.fid = open(self.fn, 'rb', buffering=0)
         
         # read in calibration and meta data
         self.find_metadata = True
-        self.board_cal = []
-        self.coil_cal = []
+        self.board_cal = None
+        self.coil_cal = None
+        # the calibration entries are gathered into one buffer per table,
+        # every entry is prefixed with the : that joins it to the last
+        cal_str = {b'cal.brd': bytearray(), b'cal.ant': bytearray()}
+        n_cal = {b'cal.brd': 0, b'cal.ant': 0}
+        record_handlers = {b'|': self._read_key_record,
+                           b'cal.brd': self._read_board_record,
+                           b'cal.ant': self._read_coil_record}
         self.count = 0
+        metadata_length = self._metadata_length
+        # position of the metadata block being looked at
+        m_cursor = self._header_length+self._schedule_metadata_len
         while self.find_metadata == True:
-            test_str = self.fid.read(self._metadata_length)
-            if test_str.lower().find('metadata record') > 0:
+            if prebuf is not None and \
+               m_cursor+metadata_length <= len(prebuf):
+                test_str = prebuf[m_cursor:m_cursor+metadata_length]
+            elif self.fid is not None:
+                test_str = _read_block(self.fid, metadata_length, m_cursor)
+            else:
+                test_str = b''
+            if test_str.lower().find(b'metadata record') > 0:
                 self.count += 1
-                cal_find = False
-                test_str = test_str.strip().split('\n')[1] 
-                if test_str.count('|') > 1:
-                    for t_str in test_str.split('|'):
-                        if t_str.find('=') == -1 and \
-                           t_str.lower().find('line.name') == -1:
-                            pass
-                        elif t_str.lower().find('line.name') >= 0:
-                            t_list = t_str.split(',')
-                            t_key = t_list[0].strip().replace('.', '_')
-                            t_value = t_list[1].strip()
-                            setattr(self, t_key.lower(), t_value)
-                        else:
-                            t_list = t_str.split('=')
-                            t_key = t_list[0].strip().replace('.', '_')
-                            t_value = t_list[1].strip()
-                            setattr(self, t_key.lower(), t_value)
-                elif test_str.lower().find('cal.brd') >= 0:
-                    t_list = test_str.split(',')
-                    t_key = t_list[0].strip().replace('.', '_')
-                    setattr(self, t_key.lower(), t_list[1])
-                    for t_str in t_list[2:]:
-                        t_str = t_str.replace('\x00', '').replace('|', '')
-                        try:
-                            self.board_cal.append([float(tt.strip())
-                                               for tt in t_str.strip().split(':')])
-                        except ValueError:
-                            self.board_cal.append([tt.strip()
-                                               for tt in t_str.strip().split(':')])
-                # some times the coil calibration does not start on its own line
-                # so need to parse the line up and I'm not sure what the calibration
-                # version is for so I have named it odd
-                elif test_str.lower().find('cal.ant') >= 0:
-                    # check to see if the coil calibration exists  
-                    cal_find = True
-                    if test_str.find('|') > 0:
-                        odd_str = test_str.split('|')[0]
-                        odd_list = odd_str.split(',')
-                        odd_key = odd_list[0].strip().replace('.', '_')
-                        setattr(self, odd_key.lower(), odd_list[1].strip())
-                        
-                        #this may be for a specific case so should test this
-                        test_str = test_str.split('|')[1]
-                        test_list = test_str.split(',')
-                        if test_list[0].lower().find('cal.ant') >= 0:
-                            m_list = test_list[0].split('=')
-                            m_key = m_list[0].strip().replace('.', '_')
-                            setattr(self, m_key.lower(), m_list[1].strip())
-                        else:
-                            for t_str in test_list[1:]:
-                                self.coil_cal.append([float(tt.strip()) 
-                                                 for tt in t_str.split(':')])
-                elif cal_find:
-                    t_list = test_str.split(',')
-                    for t_str in t_list:
-                        if t_str.find('\x00') >= 0:
-                            pass
-                        else:
-                            self.coil_cal.append([float(tt.strip()) 
-                                                for tt in t_str.strip().split(':')])
+                test_str = test_str.strip().split(b'\n')[1] 
+                record_tag = _metadata_record_tag(test_str.lower())
+                if record_tag is not None:
+                    for cal_entry in record_handlers[record_tag](test_str):
+                        cal_str[record_tag] += b':'+cal_entry
+                        n_cal[record_tag] += 1
+                m_cursor += metadata_length
             else:
                 self.find_metadata = False
                 # need to go back to where the meta data was found wo
                 # we don't skip a gps time stamp
-                self.m_tell = self.fid.tell()-self._metadata_length
+                self.m_tell = m_cursor
                     
         # make coil calibration and board calibration structured arrays
-        if len(self.coil_cal) > 0:
-            self.coil_cal = np.core.records.fromrecords(self.coil_cal, 
-                                           names='frequency, amplitude, phase',
-                                           formats='f8, f8, f8')
-        if len(self.board_cal) > 0:
-            try:
-                self.board_cal = np.core.records.fromrecords(self.board_cal,
-                                                             names='frequency, rate, amplitude, phase',
-                                                             formats='f8, f8, f8, f8')
-            except ValueError:
-                self.board_cal = None
+        if n_cal[b'cal.ant'] > 0:
+            self.coil_cal = _parse_cal(cal_str[b'cal.ant'][1:],
+                                       n_cal[b'cal.ant'], _coil_cal_dtype)
+        if n_cal[b'cal.brd'] > 0:
+            self.board_cal = _parse_cal(cal_str[b'cal.brd'][1:],
+                                        n_cal[b'cal.brd'], _board_cal_dtype)
                                    
         self.station = '{0}{1}'.format(self.line_name,
                                        self.rx_xyz0.split(':')[0])
 
+    def _read_key_record(self, record):
+        """
+        set the key=value entries of a | separated metadata record, the
+        line name is given as line.name,value.  There are no calibration
+        entries so returns an empty list.
+        """
+        record_dict = {}
+        for t_str in record.split(b'|'):
+            if b'line.name' in t_str.lower():
+                t_key, sep, t_value = t_str.partition(b',')
+            else:
+                t_key, sep, t_value = t_str.partition(b'=')
+            if sep:
+                t_key = _key_name(t_key, _metadata_key_table,
+                                  _metadata_key_cache)
+                record_dict[t_key] = t_value.strip().decode('ascii', 'ignore')
+        self.__dict__.update(record_dict)
+        return []
+        
+    def _read_board_record(self, record):
+        """
+        read a board calibration record, CAL.BRD,value,entry,entry,...
+        returns the list of calibration entries.
+        """
+        t_list = record.split(b',')
+        t_key = _key_name(t_list[0], _metadata_key_table, _metadata_key_cache)
+        setattr(self, t_key, t_list[1].decode('ascii', 'ignore'))
+        
+        cal_list = []
+        for t_str in t_list[2:]:
+            t_str = t_str.replace(b'\x00', b'').replace(b'|', b'').strip()
+            if t_str:
+                cal_list.append(t_str)
+        return cal_list
+        
+    def _read_coil_record(self, record):
+        """
+        read a coil calibration record, returns the list of calibration 
+        entries.
+        
+        some times the coil calibration does not start on its own line
+        so need to parse the line up and I'm not sure what the calibration
+        version is for so I have named it odd
+        """
+        cal_list = []
+        if record.find(b'|') > 0:
+            odd_str, sep, record = record.partition(b'|')
+            odd_key, sep, odd_value = odd_str.partition(b',')
+            odd_key = _key_name(odd_key, _metadata_key_table,
+                                _metadata_key_cache)
+            setattr(self, odd_key, odd_value.strip().decode('ascii', 'ignore'))
+            
+            #this may be for a specific case so should test this
+            record = record.partition(b'|')[0]
+            test_list = record.split(b',')
+            if b'cal.ant' in test_list[0].lower():
+                m_key, sep, m_value = test_list[0].partition(b'=')
+                m_key = _key_name(m_key, _metadata_key_table,
+                                  _metadata_key_cache)
+                setattr(self, m_key, m_value.strip().decode('ascii', 'ignore'))
+            # the coil calibration follows the coil number
+            for t_str in test_list[1:]:
+                if b'\x00' not in t_str and t_str.strip():
+                    cal_list.append(t_str.strip())
+        return cal_list
+
         
 #==============================================================================
 # 
@@ -547,12 +1090,11 @@ class Zen3D(object):
     ======================== ================================ =================
     Attributes               Description                      Default Value
     ======================== ================================ =================
-    _block_len               length of data block to read in  65536
-                             as chunks faster reading
     _counts_to_mv_conversion conversion factor to convert     9.53674316406e-10
                              counts to mv                   
-    _gps_bytes               number of bytes for a gps stamp  16
+    _gps_bytes               number of int32 words in a stamp 16
     _gps_dtype               data type for a gps stamp        see below
+    _gps_dtype_float         _gps_dtype with time as float32
     _gps_epoch               starting date of GPS time
                              format is a tuple                (1980, 1, 6, 0, 
                                                                0, 0, -1, -1, 0)
@@ -561,6 +1103,7 @@ class Zen3D(object):
     _gps_f1                  second gps flag in raw binary     
     _gps_flag_0              first gps flag as an int32       2147483647       
     _gps_flag_1              second gps flag as an int32      -2147483648  
+    _gps_flag_64             both gps flags as one int64
     _gps_stamp_length        bit length of gps stamp          64 
     _leap_seconds            leap seconds, difference         16
                              between UTC time and GPS 
@@ -653,15 +1196,16 @@ class Zen3D(object):
         self.metadata = Z3D_Metadata(fn)
         
         self._gps_stamp_length = kwargs.pop('stamp_len', 64)
-        self._gps_bytes = self._gps_stamp_length/4
+        self._gps_bytes = self._gps_stamp_length//4
         
         self.gps_stamps = None
         
         self._gps_flag_0 = np.int32(2147483647)
         self._gps_flag_1 = np.int32(-2147483648)
-        self._gps_f0 = self._gps_flag_0.tostring()
-        self._gps_f1 = self._gps_flag_1.tostring()
+        self._gps_f0 = self._gps_flag_0.tobytes()
+        self._gps_f1 = self._gps_flag_1.tobytes()
         self.gps_flag = self._gps_f0+self._gps_f1
+        self._gps_flag_64 = np.frombuffer(self.gps_flag, dtype='<i8')[0]
 
         self._gps_dtype = np.dtype([('flag0', np.int32),
                                      ('flag1', np.int32),
@@ -677,12 +1221,18 @@ class Zen3D(object):
                                      ('pps_count', np.int32),
                                      ('dac_tune', np.int32),
                                      ('block_len', np.int32)])
+        # same layout with the time as seconds, int32 and float32 are the
+        # same width so the stamps can be viewed rather than copied
+        dt = self._gps_dtype.descr
+        dt[2] = ('time', np.float32)
+        self._gps_dtype_float = np.dtype(dt)
                                      
         self._week_len = 604800
         self._gps_epoch = (1980, 1, 6, 0, 0, 0, -1, -1, 0)
         self._leap_seconds = 16
-        self._block_len = 2**16
         self.zen_schedule = None
+        # file the header, schedule and metadata were last read from
+        self._info_fn = None
         # the number in the cac files is for volts, we want mV
         self._counts_to_mv_conversion = 9.5367431640625e-10
 
@@ -690,6 +1240,11 @@ class Zen3D(object):
         self.df = None
         
         self.ts_obj = mtts.MT_TS()
+        
+        # scaling applied to each component before writing, components
+        # not in here are written as they are
+        self._channel_scalers = {'ex':self._scale_e_channel,
+                                 'ey':self._scale_e_channel}
 
     @property
     def station(self):
@@ -700,7 +1255,7 @@ class Zen3D(object):
         self.metadata.station = station
         
     #====================================== 
-    def _read_header(self, fn=None, fid=None):
+    def _read_header(self, fn=None, fid=None, prebuf=None):
         """
         read header information from Z3D file
         
@@ -712,6 +1267,9 @@ class Zen3D(object):
             **fid** : file object
                       if the file is open give the file id object
                       
+            **prebuf** : string
+                         prologue of the file from read_prologue
+                      
         Outputs:
         ----------
             * fills the Zen3ZD.header object's attributes
@@ -736,11 +1294,11 @@ class Zen3D(object):
         if fn is not None:
             self.fn = fn
             
-        self.header.read_header(fn=self.fn, fid=fid)
+        self.header.read_header(fn=self.fn, fid=fid, prebuf=prebuf)
         self.df = self.header.ad_rate
         
     #====================================== 
-    def _read_schedule(self, fn=None, fid=None):
+    def _read_schedule(self, fn=None, fid=None, prebuf=None):
         """
         read schedule information from Z3D file
         
@@ -752,6 +1310,9 @@ class Zen3D(object):
             **fid** : file object
                       if the file is open give the file id object
                       
+            **prebuf** : string
+                         prologue of the file from read_prologue
+                      
         Outputs:
         ----------
             * fills the Zen3ZD.schedule object's attributes
@@ -775,13 +1336,14 @@ class Zen3D(object):
         if fn is not None:
             self.fn = fn
             
-        self.schedule.read_schedule_metadata(fn=self.fn, fid=fid)
+        self.schedule.read_schedule_metadata(fn=self.fn, fid=fid,
+                                             prebuf=prebuf)
         # set the zen schedule time
         self.zen_schedule = '{0},{1}'.format(self.schedule.Date, 
                                              self.schedule.Time)
     
     #======================================     
-    def _read_metadata(self, fn=None, fid=None):
+    def _read_metadata(self, fn=None, fid=None, prebuf=None):
         """
         read header information from Z3D file
         
@@ -793,6 +1355,9 @@ class Zen3D(object):
             **fid** : file object
                       if the file is open give the file id object
                       
+            **prebuf** : string
+                         prologue of the file from read_prologue
+                      
         Outputs:
         ----------
             * fills the Zen3ZD.metadata object's attributes
@@ -816,19 +1381,77 @@ class Zen3D(object):
         if fn is not None:
             self.fn = fn
             
-        self.metadata.read_metadata(fn=self.fn, fid=fid)
+        self.metadata.read_metadata(fn=self.fn, fid=fid, prebuf=prebuf)
     
     #=====================================    
     def read_all_info(self):
         """
         Read header, schedule, and metadata
         """
-        with open(self.fn, 'rb') as file_id:
+        with mmap_open(self.fn) as z3d_map:
+            prologue = read_prologue(z3d_map)
+            self._read_header(fid=z3d_map, prebuf=prologue)
+            self._read_schedule(fid=z3d_map, prebuf=prologue)
+            self._read_metadata(fid=z3d_map, prebuf=prologue)
+        self._info_fn = self.fn
         
-            self._read_header(fid=file_id)
-            self._read_schedule(fid=file_id)
-            self._read_metadata(fid=file_id)        
+    #=====================================    
+    def read_metadata_minimal(self):
+        """
+        Read just metadata.rx_xyz0 from the first metadata block, which is
+        enough to tell which station a file belongs to.  If it is not there
+        all the metadata are read.
+        """
+        rx_xyz0 = _read_rx_xyz0(self.fn)
+        if rx_xyz0 is None:
+            self._read_metadata()
+        else:
+            self.metadata.rx_xyz0 = rx_xyz0
         
+    #======================================    
+    def _extract_gps_stamps(self, data):
+        """
+        pull the gps stamps out of the raw int32 data and put the data 
+        points between them into ts_obj.ts in mV as np.float32
+        
+        Arguments
+        -------------
+            **data** : np.ndarray(dtype=np.int32)
+                       everything after the metadata, can be read only
+        """
+        # find the gps stamps, flag0 followed by flag1
+        gps_stamp_find = _find_gps_flags(data, self._gps_flag_64)
+        
+        # skip the first two stamps and trim data, the stamps found so far
+        # just shift with the data
+        data = data[gps_stamp_find[3]:]
+        gps_stamp_find = gps_stamp_find[3:]-gps_stamp_find[3]
+        
+        # a stamp has to fit in the data
+        gps_words = self._gps_bytes
+        gps_stamp_find = gps_stamp_find[gps_stamp_find+gps_words <= data.size]
+        
+        # gather the words of every stamp into rows and view each row as
+        # a gps stamp
+        stamp_index = gps_stamp_find[:, np.newaxis]+np.arange(gps_words)
+        self.gps_stamps = data[stamp_index].view(self._gps_dtype).ravel()
+        
+        # number of data points between stamps
+        self.gps_stamps['block_len'][0] = 0
+        self.gps_stamps['block_len'][1:] = np.diff(gps_stamp_find)-gps_words
+        
+        # mask out the stamp words, a data point can legitimately be 0
+        stamp_mask = np.zeros(data.size, dtype=bool)
+        stamp_mask[stamp_index.ravel()] = True
+
+        # trim the data after taking out the gps stamps and convert it to mV
+        # in the same pass.  float32 holds the 24 bit counts exactly and 
+        # halves the memory of the time series.
+        self.ts_obj = mtts.MT_TS()
+        self.ts_obj.ts = np.multiply(data[~stamp_mask], 
+                                     np.float32(self._counts_to_mv_conversion),
+                                     dtype=np.float32)
+
     #======================================    
     def read_z3d(self, z3d_fn=None):
         """
@@ -843,6 +1466,9 @@ class Zen3D(object):
         
         Converts gps_stamps['time'] to seconds relative to header.gps_week 
         
+        The time series is stored in mV as np.float32, single precision is 
+        enough for the 24 bit counts of the zen.
+        
         We skip the first two gps stamps because there is something wrong with 
         the data there due to some type of buffering.  
         
@@ -859,69 +1485,26 @@ class Zen3D(object):
         print('------- Reading {0} ---------'.format(self.fn))
         st = time.time()
         
-        #get the file size to get an estimate of how many data points there are
-        file_size = os.path.getsize(self.fn)
-        
-        # using the with statement works in Python versions 2.7 or higher
-        # the added benefit of the with statement is that it will close the
-        # file object upon reading completion.
-        with open(self.fn, 'rb') as file_id:
-        
-            self._read_header(fid=file_id)
-            self._read_schedule(fid=file_id)
-            self._read_metadata(fid=file_id)
+        # map the file once, the header, schedule and metadata are sliced out
+        # of the map and the data is viewed in place without a copy
+        with mmap_open(self.fn) as z3d_map:
+            # they are not read again if read_all_info just read them, the
+            # schedule can be moved below so only use them once
+            if self._info_fn != self.fn:
+                prologue = read_prologue(z3d_map)
+                self._read_header(fid=z3d_map, prebuf=prologue)
+                self._read_schedule(fid=z3d_map, prebuf=prologue)
+                self._read_metadata(fid=z3d_map, prebuf=prologue)
+            self._info_fn = None
             
-            # move the read value to where the end of the metadata is
-            file_id.seek(self.metadata.m_tell)
+            # everything after the metadata is np.int32, we parse it later
+            data = np.frombuffer(z3d_map, dtype='<i4', 
+                                 count=(len(z3d_map)-self.metadata.m_tell)//4,
+                                 offset=self.metadata.m_tell)
+            self._extract_gps_stamps(data)
             
-            # initalize a data array filled with zeros, everything goes into
-            # this array then we parse later
-            data = np.zeros((file_size-512*(2+self.metadata.count))/4, 
-                             dtype=np.int32)
-            # go over a while loop until the data cound exceed the file size
-            data_count = 0
-            while data_count+self.metadata.m_tell/4 < data.size:
-                test_str = np.fromstring(file_id.read(self._block_len), 
-                                         dtype=np.int32)
-                data[data_count:data_count+len(test_str)] = test_str
-                data_count += test_str.size
-
-        # find the gps stamps
-        gps_stamp_find = np.where(data==self._gps_flag_0)[0]
-        
-        # skip the first two stamps and trim data
-        data = data[gps_stamp_find[3]:]
-        gps_stamp_find = np.where(data==self._gps_flag_0)[0]
-        
-        self.gps_stamps = np.zeros(len(gps_stamp_find), dtype=self._gps_dtype)
-        
-        for ii, gps_find in enumerate(gps_stamp_find):
-            try:
-                data[gps_find+1]
-            except IndexError:
-                print('***Failed gps stamp***')
-                print('    stamp {0} out of {1}'.format(ii+1, 
-                                                        len(gps_stamp_find)))
-                break
-            
-            if data[gps_find+1] == self._gps_flag_1:
-                gps_str = struct.pack('<'+'i'*self._gps_bytes,
-                                      *data[gps_find:gps_find+self._gps_bytes])
-                self.gps_stamps[ii] = np.fromstring(gps_str, 
-                                                   dtype=self._gps_dtype)
-                if ii > 0:
-                    self.gps_stamps[ii]['block_len'] = gps_find-\
-                                           gps_stamp_find[ii-1]-self._gps_bytes 
-                elif ii == 0:
-                    self.gps_stamps[ii]['block_len'] = 0
-                data[gps_find:gps_find+self._gps_bytes] = 0
-
-        # trim the data after taking out the gps stamps
-        self.ts_obj = mtts.MT_TS()
-        self.ts_obj.ts = data[np.nonzero(data)]
-
-        # convert data to mV
-        self.convert_counts_to_mv()
+            # the map cannot be closed while an array still points into it
+            del data
 
         # fill time series object metadata
         self.ts_obj.station = self.station
@@ -994,7 +1577,7 @@ class Zen3D(object):
         self.schedule.Time = zen_start.split(',')[1]
         
         # estimate the time difference between the two                                               
-        time_diff = time.mktime(zen_time)-time.mktime(schedule_time)
+        time_diff = calendar.timegm(zen_time)-calendar.timegm(schedule_time)
         print('    Scheduled time was {0} (GPS time)'.format(s_start))
         print('    1st good stamp was {0} (GPS time)'.format(zen_start))
         print('    difference of {0:.2f} seconds'.format(time_diff))
@@ -1005,12 +1588,9 @@ class Zen3D(object):
         make sure each time stamp is 1 second apart
         """
         
-        t_diff = np.zeros_like(self.gps_stamps['time'])
-        
-        for ii in range(len(t_diff)-1):
-            t_diff[ii] = self.gps_stamps['time'][ii]-self.gps_stamps['time'][ii+1]
+        t_diff = np.diff(self.gps_stamps['time'])
         
-        bad_times = np.where(abs(t_diff) > 0.5)[0]
+        bad_times = np.where(np.abs(t_diff) > 0.5)[0]
         if len(bad_times) > 0:
             print('-'*50)
             for bb in bad_times:
@@ -1027,9 +1607,14 @@ class Zen3D(object):
                                 
         if len(bad_blocks) > 0:
             if bad_blocks.max() < 5:
-                ts_skip = self.gps_stamps['block_len'][0:bad_blocks[-1]+1].sum()
-                self.gps_stamps = self.gps_stamps[bad_blocks[-1]:]
-                self.time_series = self.time_series[ts_skip:]
+                cutoff = bad_blocks[-1]
+                ts_skip = int(self.gps_stamps['block_len'][0:cutoff+1].sum())
+                # copy so the dropped stamps are not kept alive by a view
+                self.gps_stamps = self.gps_stamps[cutoff:].copy()
+                self.ts_obj.ts = self.ts_obj.ts.data.values[ts_skip:]
+                # the kept data start ts_skip samples after the old start
+                self.ts_obj.start_time_epoch_sec = \
+                    self.ts_obj.start_time_epoch_sec+ts_skip/float(self.df)
                 
                 print('{0}Skipped the first {1} seconds'.format(' '*4,
                                                                 bad_blocks[-1]))
@@ -1041,18 +1626,15 @@ class Zen3D(object):
         """
         convert gps time integer to relative seconds from gps_week
         """
-        # need to convert gps_time to type float from int
-        dt = self._gps_dtype.descr
-        dt[2] = ('time', np.float32)
-        self.gps_stamps = self.gps_stamps.astype(np.dtype(dt))
-        
         # convert to seconds
         # these are seconds relative to the gps week
-        time_conv = self.gps_stamps['time'].copy()/1024.
+        time_conv = self.gps_stamps['time']/1024.
         time_ms = (time_conv-np.floor(time_conv))*1.024
         time_conv = np.floor(time_conv)+time_ms
         
-        self.gps_stamps['time'][:] = time_conv 
+        # reinterpret the stamps with a float time and fill it in
+        self.gps_stamps = self.gps_stamps.view(self._gps_dtype_float)
+        self.gps_stamps['time'] = time_conv
             
     #==================================================    
     def convert_counts_to_mv(self):
@@ -1142,13 +1724,9 @@ class Zen3D(object):
             
         mseconds = gps_time % 1
         
-        #make epoch in seconds, mktime computes local time, need to subtract
-        #time zone to get UTC
-        epoch_seconds = time.mktime(self._gps_epoch)-time.timezone
-        
         #gps time is 14 seconds ahead of GTC time, but I think that the zen
         #receiver accounts for that so we will leave leap seconds to be 0        
-        gps_seconds = epoch_seconds+(gps_week*self._week_len)+gps_time-\
+        gps_seconds = gps_epoch_seconds+(gps_week*self._week_len)+gps_time-\
                                                         self._leap_seconds
 
         #compute date and time from seconds
@@ -1253,8 +1831,7 @@ class Zen3D(object):
         # make a new file name to save to that includes the meta information
         if save_fn is None:
             svfn_directory = os.path.join(os.path.dirname(self.fn), 'TS')
-            if not os.path.exists(svfn_directory):
-                os.mkdir(svfn_directory)
+            os.makedirs(svfn_directory, exist_ok=True)
 
             svfn_date = ''.join(self.schedule.Date.split('-'))
             svfn_time = ''.join(self.schedule.Time.split(':'))
@@ -1271,7 +1848,7 @@ class Zen3D(object):
         else:
             self.fn_mt_ascii = save_fn
         # if the file already exists skip it
-        if os.path.isfile(self.fn_mt_ascii) == True:
+        if os.path.isfile(self.fn_mt_ascii):
             print('   ************')
             print('    mtpy file already exists for {0} --> {1}'.format(self.fn,
                                                                     self.fn_mt_ascii))            
@@ -1300,25 +1877,53 @@ class Zen3D(object):
         # convert counts to mV and scale accordingly    
         # self.convert_counts() #--> data is already converted to mV
         # calibrate electric channels should be in mV/km
-        # I have no idea why this works but it does
-        if self.metadata.ch_cmp.lower() in ['ex', 'ey']:
-            e_scale = float(self.metadata.ch_length)
-            self.ts_obj.ts.data /= ((e_scale/100)*2*np.pi)
-            print('Using scales {0} = {1} m'.format(self.metadata.ch_cmp.upper(),
-                                                    e_scale))
-            self.ts_obj.units = 'mV/km'
+        channel_scaler = self._channel_scalers.get(
+                                            self.metadata.ch_cmp.lower())
+        if channel_scaler is not None:
+            channel_scaler()
 
-        self.ts_obj.write_ascii_file(fn_ascii=self.fn_mt_ascii)                                         
+        self.ts_obj.write_ascii_file(fn_ascii=self.fn_mt_ascii, fmt=fmt)                                         
         
         print('Wrote mtpy timeseries file to {0}'.format(self.fn_mt_ascii))
     
+    #==================================================
+    def _scale_e_channel(self):
+        """
+        scale an electric channel by the dipole length to mV/km
+        """
+        # I have no idea why this works but it does
+        e_scale = float(self.metadata.ch_length)
+        self.ts_obj.ts['data'] *= 100./(e_scale*2*np.pi)
+        print('Using scales {0} = {1} m'.format(self.metadata.ch_cmp.upper(),
+                                                e_scale))
+        self.ts_obj.units = 'mV/km'
+    
     #==================================================                                                           
-    def plot_time_series(self, fig_num=1):
+    def plot_time_series(self, fig_num=1, max_points=20000):
         """
         plots the time series
+        
+        Arguments
+        -------------
+            **max_points** : int
+                             longer time series are reduced to the minimum 
+                             and maximum of each block of points so about
+                             max_points are drawn and the envelope is kept
+                             *default* is 20000
         """                                                               
-
-        self.ts_obj.ts.plot(x_compat=True)
+        ts_data = self.ts_obj.ts.data
+        stride = ts_data.size//max(max_points//2, 1)
+        if stride <= 1:
+            ts_data.plot(x_compat=True)
+            return
+            
+        n_blocks = ts_data.size//stride
+        ts_blocks = ts_data.values[0:n_blocks*stride].reshape(n_blocks, stride)
+        ts_index = ts_data.index[0:n_blocks*stride:stride]
+        ts_envelope = pd.Series(np.column_stack((ts_blocks.min(axis=1),
+                                                 ts_blocks.max(axis=1))).ravel(),
+                                index=ts_index.repeat(2))
+        ts_envelope.plot(x_compat=True)
     
     #==================================================    
     def plot_spectrogram(self, time_window=2**8, time_step=2**6, s_window=11,
@@ -1417,6 +2022,7 @@ class ZenSchedule(object):
     sa_keys                keys for schedule actions
     sa_list                 list of schedule actions including time and df
     sr_dict                dictionary of sampling rate values
+    sr_dict_int            sr_dict keyed by the sampling rate as an int
     verbose                [ True | False ] True to print information to 
                            console 
     ====================== ====================================================
@@ -1429,6 +2035,8 @@ class ZenSchedule(object):
         self.verbose = True
         self.sr_dict = {'256':'0', '512':'1', '1024':'2', '2048':'3', 
                         '4096':'4'}
+        self.sr_dict_int = dict([(int(key), self.sr_dict[key]) 
+                                 for key in self.sr_dict])
         self.gain_dict = dict([(mm, 2**mm) for mm in range(7)])
         self.sa_keys = ['date', 'time', 'resync_yn', 'log_yn', 'tx_duty', 
                         'tx_period', 'sr', 'gain', 'nf_yn']
@@ -1463,34 +2071,47 @@ class ZenSchedule(object):
         
         """
         
-        sfid = file(fn, 'r')
-        lines = sfid.readlines()
+        with open(fn, 'r') as sfid:
+            schedule_str = sfid.read()
         
-        for line in lines:
-            if line.find('scheduleaction') == 0:
-                line_list = line.strip().split(' ')[1].split(',')
-                sa_dict = {}
-                for ii, key in enumerate(self.sa_keys):
-                    sa_dict[key] = line_list[ii]
-                self.sa_list.append(sa_dict)
-                
-            elif line.find('metadata'.upper()) == 0:
-                line_list = line.strip().split(' ')[1].split('|')
-                for md in line_list[:-1]:
-                    md_list = md.strip().split(',')
-                    self.meta_dict[md_list[0]] = md_list[1]
-                    
-            elif line.find('offset') == 0:
-                line_str = line.strip().split(' ')
-                self.offset = line_str[1]
-                
-            elif line.find('Light') > 0:
-                line_list = line.strip().split(' ')
-                try:
-                    self.light_dict[line_list[0]]
-                    self.light_dict[line_list[0]] = line_list[1]
-                except KeyError:
-                    pass
+        line_readers = {'scheduleaction':self._read_schedule_action,
+                        'METADATA':self._read_schedule_metadata,
+                        'offset':self._read_schedule_offset}
+        for line_key, line_value in _schedule_cfg_re.findall(schedule_str):
+            line_reader = line_readers.get(line_key, self._read_schedule_light)
+            line_reader(line_key, line_value)
+            
+    def _read_schedule_action(self, line_key, line_value):
+        """
+        add a schedule action 'date,time,...' to sa_list
+        """
+        line_list = line_value.split(',')
+        sa_dict = {}
+        for ii, key in enumerate(self.sa_keys):
+            sa_dict[key] = line_list[ii]
+        self.sa_list.append(sa_dict)
+        
+    def _read_schedule_metadata(self, line_key, line_value):
+        """
+        fill meta_dict from metadata 'key,value|key,value|'
+        """
+        line_list = line_value.split('|')
+        for md in line_list[:-1]:
+            md_list = md.strip().split(',')
+            self.meta_dict[md_list[0]] = md_list[1]
+            
+    def _read_schedule_offset(self, line_key, line_value):
+        """
+        set the offset of the schedule
+        """
+        self.offset = line_value
+        
+    def _read_schedule_light(self, line_key, line_value):
+        """
+        set a light that is in light_dict, other lights are skipped
+        """
+        if line_key in self.light_dict:
+            self.light_dict[line_key] = line_value
     
     #==================================================            
     def add_time(self, date_time, add_minutes=0, add_seconds=0, add_hours=0,
@@ -1502,7 +2123,7 @@ class ZenSchedule(object):
         
         """    
         
-        fulldate = datetime.datetime.strptime(date_time, self.dt_format)
+        fulldate = _parse_date_time(date_time, self.dt_format)
                                      
         fulldate = fulldate + datetime.timedelta(days=add_days,
                                                  hours=add_hours,
@@ -1544,25 +2165,30 @@ class ZenSchedule(object):
         if t1_dict is not None:
             time_list = [{'dt':self.initial_dt,'df':t1_dict['df']}]
     
-            kk = np.where(np.array(df_list)==t1_dict['df'])[0]-ndf+1
+            kk = np.where(np.array(df_list)==t1_dict['df'])[0][0]-ndf+1
             df_list = np.append(df_list[kk:], df_list[:kk])
             df_length_list = np.append(df_length_list[kk:], df_length_list[:kk])
             time_list.append(dict([('dt',t1_dict['dt']), ('df',df_list[0])]))
-            ii = 1
         else:
             time_list = [{'dt':self.initial_dt,'df':df_list[0]}]
-            ii = 0
             
-        for rr in range(1,repeat+1):
-            for df, df_length, jj in zip(df_list, df_length_list, list(range(ndf))):
-                dtime = time.strptime(df_length, '%H:%M:%S')
-                ndt = self.add_time(time_list[ii]['dt'], 
-                                    add_hours=dtime.tm_hour,
-                                    add_minutes=dtime.tm_min,
-                                    add_seconds=dtime.tm_sec)
-                time_list.append({'dt':ndt.strftime(self.dt_format),
-                                 'df':df_list[jj-ndf+1]})
-                ii += 1
+        # length of each sampling rate in seconds, the start of every 
+        # following event is then a cumulative sum from the last event
+        df_seconds = []
+        for df_length in df_length_list:
+            dtime = time.strptime(df_length, '%H:%M:%S')
+            df_seconds.append(dtime.tm_hour*3600+dtime.tm_min*60+dtime.tm_sec)
+        dt_seconds = np.cumsum(np.tile(df_seconds, repeat))
+            
+        t0 = datetime.datetime.strptime(time_list[-1]['dt'], self.dt_format)
+        dt_arr = np.datetime64(t0, 's')+dt_seconds.astype('timedelta64[s]')
+        dt_arr = np.char.replace(np.datetime_as_string(dt_arr, unit='s'),
+                                 'T', ',')
+        
+        # each event records at the next sampling rate in the list
+        df_arr = np.tile(np.roll(df_list, -1), repeat)
+        time_list += [{'dt':dt, 'df':df} for dt, df in zip(dt_arr.tolist(), 
+                                                          df_arr.tolist())]
                 
         for nn, ns in enumerate(time_list):
             sdate, stime = ns['dt'].split(',')
@@ -1570,7 +2196,7 @@ class ZenSchedule(object):
             ns['time'] = stime
             ns['log_yn'] = 'Y'
             ns['nf_yn'] = 'Y'
-            ns['sr'] = self.sr_dict[str(ns['df'])]
+            ns['sr'] = self.sr_dict_int[int(ns['df'])]
             ns['tx_duty'] = '0'
             ns['tx_period'] = '0'
             ns['resync_yn'] = 'Y'
@@ -1603,22 +2229,23 @@ class ZenSchedule(object):
                          * 'df' --> sampling rate of that event
         """
         
-        dt_offset = '{0},{1}'.format('2000-01-01', time_offset)
-        t0 = time.mktime(time.strptime('2000-01-01,00:00:00', self.dt_format))
+        dt_offset = '{0}T{1}'.format('2000-01-01', time_offset)
+        osec = np.datetime64(dt_offset, 's')
         
-        for ii, tt in enumerate(schedule_time_list):
-            ssec = time.mktime(time.strptime(tt['dt'], self.dt_format))
-            osec = time.mktime(time.strptime(dt_offset, self.dt_format))
+        # the schedule is in time order, so find the first event after the
+        # offset with a binary search
+        ssec = np.char.replace([tt['dt'] for tt in schedule_time_list], 
+                               ',', 'T').astype('datetime64[s]')
+        ii = np.searchsorted(ssec, osec, side='right')
+        if ii == len(schedule_time_list):
+            return None
             
-            if ssec > osec:
-                sdiff = time.localtime(t0+(ssec-osec))
-                t1 = self.add_time('2000-01-01,00:00:00', 
-                                   add_hours=sdiff.tm_hour,
-                                   add_minutes=sdiff.tm_min,
-                                   add_seconds=sdiff.tm_sec)
-                s1 = {'dt':t1.strftime(self.dt_format), 
-                      'df':schedule_time_list[ii-1]['df']}
-                return s1
+        # only the time of day of the difference is kept
+        sdiff = int((ssec[ii]-osec)/np.timedelta64(1, 's')) % 86400
+        t1 = self.add_time('2000-01-01,00:00:00', add_seconds=sdiff)
+        s1 = {'dt':t1.strftime(self.dt_format), 
+              'df':schedule_time_list[ii-1]['df']}
+        return s1
     
     #==================================================            
     def write_schedule(self, station, clear_schedule=True, 
@@ -1710,8 +2337,9 @@ class ZenSchedule(object):
             save_name = 'Zeus3Ini.cfg'
         elif savename == 2:
             save_name = 'ZEN.cfg'
-            sfid = file(os.path.normpath(os.path.join('c:\\MT', save_name)),
-                        'w')
+            # the schedule actions are the same for every drive so make 
+            # them once
+            sa_line_list = []
             for sa_dict in self.sa_list:
                 new_time = self.add_time(self.dt_offset,
                                          add_hours=int(sa_dict['time'][0:2]),
@@ -1724,71 +2352,82 @@ class ZenSchedule(object):
                                     '1999999999',
                                     sa_dict['sr'],
                                     '0','0','0','y','n','n','n'])
-                sfid.write('scheduleaction '.upper()+sa_line[:-1]+'\n')
+                sa_line_list.append('scheduleaction '.upper()+sa_line[:-1]+
+                                    '\n')
+                                    
+            # collect the lines of the file and write them in one go
+            line_list = list(sa_line_list)
             meta_line = ''.join(['{0},{1}|'.format(key,self.meta_dict[key]) 
                                  for key in self.meta_keys])
-            sfid.write('METADATA '+meta_line+'\n')
+            line_list.append('METADATA '+meta_line+'\n')
             for lkey in list(self.light_dict.keys()):
-                sfid.write('{0} {1}\n'.format(lkey, self.light_dict[lkey]))
-            sfid.close()
+                line_list.append('{0} {1}\n'.format(lkey, self.light_dict[lkey]))
+            with open(os.path.normpath(os.path.join('c:\\MT', save_name)),
+                      'w') as sfid:
+                sfid.write(''.join(line_list))
             #print 'Wrote {0}:\{1} to {2} as {3}'.format(dd, save_name, dname,
             #                                       self.ch_cmp_dict[dname[-1]])
             
+            sfn_list = []
+            s_text_list = []
             for dd in list(drive_names.keys()):
                 dname = drive_names[dd]
-                sfid = file(os.path.normpath(os.path.join(dd+':\\', save_name)),
-                            'w')
-                for sa_dict in self.sa_list:
-                    new_time = self.add_time(self.dt_offset,
-                                             add_hours=int(sa_dict['time'][0:2]),
-                                             add_minutes=int(sa_dict['time'][3:5]),
-                                             add_seconds=int(sa_dict['time'][6:]))
-                    sa_line = ','.join([new_time.strftime(self.dt_format),
-                                        sa_dict['resync_yn'], 
-                                        sa_dict['log_yn'],
-                                        '2047',
-                                        '1999999999',
-                                        sa_dict['sr'],
-                                        '0','0','0','y','n','n','n'])
-                    sfid.write('scheduleaction '.upper()+sa_line[:-1]+'\n')
+                line_list = list(sa_line_list)
                 
                 self.meta_dict['Ch.Cmp'] = self.ch_cmp_dict[dname[-1]]
                 self.meta_dict['Ch.Number'] = dname[-1]
                 meta_line = ''.join(['{0},{1}|'.format(key,self.meta_dict[key]) 
                                      for key in self.meta_keys])
-                sfid.write('METADATA '+meta_line+'\n')
+                line_list.append('METADATA '+meta_line+'\n')
                 for lkey in list(self.light_dict.keys()):
-                    sfid.write('{0} {1}\n'.format(lkey, self.light_dict[lkey]))
-                sfid.close()
+                    line_list.append('{0} {1}\n'.format(lkey, 
+                                                        self.light_dict[lkey]))
+                sfn_list.append(os.path.normpath(os.path.join(dd+':\\', 
+                                                              save_name)))
+                s_text_list.append(''.join(line_list))
+                
+            # each SD card is its own device so write to all of them at once
+            _write_text_files(sfn_list, s_text_list)
+            for dd in list(drive_names.keys()):
+                dname = drive_names[dd]
                 print('Wrote {0}:\{1} to {2} as {3}'.format(dd, save_name, dname,
                                                    self.ch_cmp_dict[dname[-1]]))
             return
         else:
             save_name = savename
          
+        get_sa_values = operator.itemgetter(*self.sa_keys)
+        sfn_list = []
+        s_text_list = []
         for dd in list(drive_names.keys()):
             dname = drive_names[dd]
-            sfid = file(os.path.normpath(os.path.join(dd+':\\', save_name)),
-                        'w')
+            line_list = []
             if clear_schedule:
-                sfid.write('clearschedule\n')
+                line_list.append('clearschedule\n')
             if clear_metadata:
-                sfid.write('metadata clear\n')
+                line_list.append('metadata clear\n')
             for sa_dict in self.sa_list:
                 if gain != 0:
                     sa_dict['gain'] = gain
-                sa_line = ''.join([sa_dict[key]+',' for key in self.sa_keys])
-                sfid.write('scheduleaction '+sa_line[:-1]+'\n')
-            sfid.write('offsetschedule {0}\n'.format(self.dt_offset))
+                sa_line = ','.join(get_sa_values(sa_dict))
+                line_list.append('scheduleaction '+sa_line+'\n')
+            line_list.append('offsetschedule {0}\n'.format(self.dt_offset))
             
             self.meta_dict['Ch.Cmp'] = self.ch_cmp_dict[dname[-1]]
             self.meta_dict['Ch.Number'] = dname[-1]
             meta_line = ''.join(['{0},{1}|'.format(key,self.meta_dict[key]) 
                                  for key in self.meta_keys])
-            sfid.write('METADATA '+meta_line+'\n')
+            line_list.append('METADATA '+meta_line+'\n')
             for lkey in list(self.light_dict.keys()):
-                sfid.write('{0} {1}\n'.format(lkey, self.light_dict[lkey]))
-            sfid.close()
+                line_list.append('{0} {1}\n'.format(lkey, self.light_dict[lkey]))
+            sfn_list.append(os.path.normpath(os.path.join(dd+':\\', 
+                                                          save_name)))
+            s_text_list.append(''.join(line_list))
+            
+        # each SD card is its own device so write to all of them at once
+        _write_text_files(sfn_list, s_text_list)
+        for dd in list(drive_names.keys()):
+            dname = drive_names[dd]
             print('Wrote {0}:\{1} to {2} as {3}'.format(dd, save_name, dname,
                                                    self.ch_cmp_dict[dname[-1]]))
                                                    
@@ -1869,13 +2508,12 @@ class ZenSchedule(object):
             zacq_list.append('$schline{0:.0f} = {1:.0f},{2:.0f},{3:.0f}\n'.format(
                                 ii+1, 
                                 t_diff,
-                                int(self.sr_dict[str(ss['df'])]),
+                                int(self.sr_dict_int[int(ss['df'])]),
                                 1))
         
         fn = os.path.join(save_path, schedule_fn)
-        fid = file(fn, 'w')
-        fid.writelines(zacq_list[0:16])
-        fid.close()
+        with open(fn, 'w') as fid:
+            fid.write(''.join(zacq_list[0:16]))
         
         print('Wrote schedule file to {0}'.format(fn))
         print('+--------------------------------------+')
@@ -1930,13 +2568,19 @@ def get_drives():
         >>> import mtpy.usgs.zen as zen
         >>> zen.get_drives()
     
+    """
+    return _drive_letters(win32api.GetLogicalDrives())
+
+def _drive_letters(bitmask):
+    """
+    drive letters of a GetLogicalDrives bitmask, lowest bit is A
     """
     drives = []
-    bitmask = win32api.GetLogicalDrives()
-    for letter in string.uppercase:
-        if bitmask & 1:
-            drives.append(letter)
-        bitmask >>= 1
+    # only loop over the set bits
+    while bitmask:
+        low_bit = bitmask & -bitmask
+        drives.append(chr(ord('A')+low_bit.bit_length()-1))
+        bitmask ^= low_bit
 
     return drives
    
@@ -1959,32 +2603,202 @@ def get_drive_names():
         >>> zen.get_drives_names()
     """
     
-    drives = get_drives()
+    drive_dict = _get_drive_names(win32api.GetLogicalDrives())
     
+    if drive_dict == {}:
+        print('No external drives detected, check the connections.')
+        return None
+    else:
+        return drive_dict
+
+def _get_drive_names(bitmask):
+    """
+    volume names of the drives in bitmask that are channel cards.  The 
+    volumes are queried on every call, a card can be swapped for another
+    one under the same drive letter.
+    """
     drive_dict = {}
-    for drive in drives:
+    for drive in _drive_letters(bitmask):
         try:
             drive_name = win32api.GetVolumeInformation(drive+':\\')[0]
             if drive_name.find('CH') > 0:
                 drive_dict[drive] = drive_name
         except:
             pass
-    
-    if drives == {}:
-        print('No external drives detected, check the connections.')
-        return None
-    else:
-        return drive_dict
+    return drive_dict
 
 #==============================================================================
 # copy files from SD cards   
 #==============================================================================
-def copy_from_sd(station, save_path=r"d:\Peacock\MTData", 
-                 channel_dict={'1':'HX', '2':'HY', '3':'HZ',
-                               '4':'EX', '5':'EY', '6':'HZ'},
-                 copy_date=None, copy_type='all'):
+# comparison of a file date with the requested date for each date type
+_date_compare = {'all':lambda zt_date, date: True,
+                 'before':operator.le,
+                 'after':operator.ge,
+                 'on':operator.eq}
+
+def _date_test(date, date_type):
     """
-    copy files from sd cards into a common folder (save_path)
+    return a function that is True if a YYYYMMDD integer date is date_type
+    of date (YYYY-MM-DD).  Everything passes if date is None and nothing
+    passes for an unknown date_type.
+    """
+    if date is None:
+        return lambda zt_date: True
+    cmp_date = int(date.replace('-',''))
+    compare = _date_compare.get(date_type, lambda zt_date, date: False)
+    return lambda zt_date: compare(zt_date, cmp_date)
+
+# log files are written in one go through a buffer this big
+_log_buffer_len = 2**16
+# windows error of a file that is open in another process
+_error_sharing_violation = 32
+# files at least this big are copied without the system file cache
+_unbuffered_copy_size = 2**28
+_copy_file_no_buffering = 0x00001000
+
+def _fast_copy(src, dst, file_size=0):
+    """
+    copy file src to dst without passing the data through python.  On 
+    windows the copy is done by the kernel with CopyFileExW, which already
+    overlaps the reads and writes, large files skip the file cache so the
+    reads from the card are not copied through it.  Elsewhere shutil.copy
+    already uses os.sendfile or the platform copy call.
+    """
+    if sys.platform == 'win32':
+        copy_flags = 0
+        if file_size >= _unbuffered_copy_size:
+            copy_flags = _copy_file_no_buffering
+        if not ctypes.windll.kernel32.CopyFileExW(src, dst, None, None, 
+                                                  None, copy_flags):
+            raise ctypes.WinError()
+    else:
+        shutil.copy(src, dst)
+    
+def _transfer_file(src, dst, delete_after=False, delete_folder=None,
+                   file_size=0):
+    """
+    copy src to dst.  If delete_after the source is removed from the card,
+    or moved into delete_folder if that is given.  Returns the verb for the
+    log.
+    """
+    if not delete_after:
+        _fast_copy(src, dst, file_size)
+        return 'copied'
+    
+    if delete_folder is None:
+        # a rename if the card and dst share a file system
+        try:
+            os.replace(src, dst)
+        except OSError:
+            _fast_copy(src, dst, file_size)
+            os.remove(src)
+    else:
+        _fast_copy(src, dst, file_size)
+        shutil.move(src, os.path.join(delete_folder, os.path.basename(src)))
+    return 'moved'
+    
+def _copy_drive(key, drive_name, station, save_path, cfg_lock, date_test,
+                write_log, info_cache=None, delete_after=False,
+                delete_folder=None):
+    """
+    copy the files of station from one SD card, see transfer_from_sd.  Only
+    files whose YYYYMMDD date passes date_test are copied.  The log lines
+    of the card are given to write_log when the card is done or stops on 
+    an error, so every file taken off the card is logged.  Returns the 
+    list of copied files.
+    """
+    dr = r"{0}:\\".format(key)
+    fn_list = []
+    log_lines = []
+    drive_header = '='*25+drive_name+'='*25
+    print(drive_header)
+    log_lines.append(drive_header+'\n')
+    try:
+        _copy_drive_files(dr, station, save_path, cfg_lock, date_test,
+                          fn_list, log_lines, info_cache=info_cache,
+                          delete_after=delete_after,
+                          delete_folder=delete_folder)
+    finally:
+        write_log(log_lines)
+    return fn_list
+    
+def _copy_drive_files(dr, station, save_path, cfg_lock, date_test, fn_list,
+                      log_lines, info_cache=None, delete_after=False,
+                      delete_folder=None):
+    """
+    copy the files of station from the SD card at dr, appending the copied
+    files to fn_list and the lines for the log to log_lines.
+    """
+    for entry in os.scandir(dr):
+        fn = entry.name
+        full_path_fn = os.path.normpath(entry.path)
+        if fn.endswith('.cfg'):
+            # every card has a schedule, only copy one at a time
+            with cfg_lock:
+                _fast_copy(full_path_fn, os.path.join(save_path, fn))
+            continue
+                
+        # the directory entry already holds the type and stat on windows
+        if not entry.is_file():
+            continue
+        fn_stat = entry.stat()
+        if fn_stat.st_size < 1600:
+            continue
+            
+        try:
+            # the station is in the first metadata block, only files of
+            # the station get all their information read
+            rx_xyz0 = _read_rx_xyz0(full_path_fn)
+            if rx_xyz0 is not None and rx_xyz0.find(station[2:]) < 0:
+                continue
+            zt = read_z3d_info(full_path_fn, fn_stat, info_cache)
+            if zt.metadata.rx_xyz0.find(station[2:]) < 0:
+                continue
+            zt_date = int(zt.schedule.Date.replace('-',''))
+            if not date_test(zt_date):
+                continue
+            
+            channel = zt.metadata.ch_cmp.upper()
+            st = zt.schedule.Time.replace(':','')
+            sd = zt.schedule.Date.replace('-','')
+            sv_fn = '{0}_{1}_{2}_{3}_{4}.Z3D'.format(station, 
+                                                     sd, 
+                                                     st,
+                                                     int(zt.df),
+                                                     channel)
+                                                 
+            full_path_sv = os.path.join(save_path, sv_fn)
+            verb = _transfer_file(full_path_fn, full_path_sv,
+                                  delete_after=delete_after,
+                                  delete_folder=delete_folder,
+                                  file_size=fn_stat.st_size)
+        except (OSError, AttributeError, IndexError, TypeError,
+                ValueError) as error:
+            # files that can not be read or parsed are skipped
+            if getattr(error, 'winerror', None) == _error_sharing_violation:
+                print('File in use at {0}'.format(full_path_fn))
+                log_lines.append('---File in use at {0}\n\n'.format(
+                                                                full_path_fn))
+            else:
+                print('Faulty file at {0}'.format(full_path_fn))
+                log_lines.append('---Faulty file at {0}\n\n'.format(
+                                                                full_path_fn))
+            continue
+            
+        fn_list.append(full_path_sv)
+        print('{0} {1} to {2}\n'.format(verb, full_path_fn, full_path_sv))
+        log_lines.append('{0} {1} to \n'.format(verb, full_path_fn)+\
+                         '       {0}\n'.format(full_path_sv))
+    
+def transfer_from_sd(station, save_path=r"d:\Peacock\MTData", 
+                     channel_dict={'1':'HX', '2':'HY', '3':'HZ',
+                                   '4':'EX', '5':'EY', '6':'HZ'},
+                     copy_date=None, copy_type='all', delete_after=True,
+                     delete_folder=None):
+    """
+    copy files from sd cards into a common folder (save_path) and 
+    optionally take them off the cards in the same pass, so the headers are 
+    only read once
     
     do not put an underscore in station, causes problems at the moment
     
@@ -2011,6 +2825,17 @@ def copy_from_sd(station, save_path=r"d:\Peacock\MTData",
                         * 'after' --> copy files on and after this date
                         * 'on' --> copy files on this date only
                         
+        **delete_after** : [ True | False ]
+                           remove each file from the SD card once it is
+                           copied, a rename if save_path is on the same
+                           file system as the card.
+                           *default* is True
+                           
+        **delete_folder** : string
+                            full path to a folder where the files taken off
+                            the cards are moved to just in case.  If None, 
+                            files are removed from the cards.
+                        
     Outputs:
     -----------
         **fn_list** : list
@@ -2019,7 +2844,7 @@ def copy_from_sd(station, save_path=r"d:\Peacock\MTData",
     :Example: ::
     
         >>> import mtpy.usgs.zen as zen
-        >>> fn_list = zen.copy_from_sd('mt01', save_path=r"/home/mt/survey_1")
+        >>> fn_list = zen.transfer_from_sd('mt01', save_path=r"/home/mt/survey_1")
     
     """
     
@@ -2029,98 +2854,110 @@ def copy_from_sd(station, save_path=r"d:\Peacock\MTData",
     save_path = os.path.join(save_path,station)
     if not os.path.exists(save_path):
         os.mkdir(save_path)
-    log_fid = file(os.path.join(save_path,'copy_from_sd.log'),'w')
-    
+    if delete_after and delete_folder is not None:
+        if not os.path.exists(delete_folder):
+            os.mkdir(delete_folder)
     
     st_test = time.ctime()
+    
+    # the cards are separate devices, so copy from all of them at once but
+    # keep the copies from one card in order
+    cfg_lock = threading.Lock()
+    log_lock = threading.Lock()
+    date_test = _date_test(copy_date, copy_type)
+    # the information read from the cards is only kept for this transfer
+    info_cache = {}
+    drive_keys = list(drive_names.keys())
+    n_workers = max(1, min(len(drive_keys), os.cpu_count()))
+    with open(os.path.join(save_path, 'copy_from_sd.log'), 'w', 
+              buffering=_log_buffer_len) as log_fid:
+        # each card writes its lines in one go so they do not interleave
+        def write_log(log_lines):
+            with log_lock:
+                log_fid.write(''.join(log_lines))
+                log_fid.flush()
+        def copy_drive(key):
+            return _copy_drive(key, drive_names[key], station, save_path, 
+                               cfg_lock, date_test, write_log,
+                               info_cache=info_cache,
+                               delete_after=delete_after,
+                               delete_folder=delete_folder)
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            copy_list = list(executor.map(copy_drive, drive_keys))
+        
     fn_list = []
-    for key in list(drive_names.keys()):
-        dr = r"{0}:\\".format(key)
-        print('='*25+drive_names[key]+'='*25)
-        log_fid.write('='*25+drive_names[key]+'='*25+'\n')
-        for fn in os.listdir(dr):
-            full_path_fn = os.path.normpath(os.path.join(dr, fn))
-            if fn[-4:] == '.cfg':
-                shutil.copy(full_path_fn, os.path.join(save_path, fn))
-                    
-            try:
-                file_size = os.stat(full_path_fn)[6]
-                if file_size >= 1600 and fn.find('.cfg') == -1:
-                    zt = Zen3D(fn=full_path_fn)
-                    zt.read_all_info()
-                    #zt.read_header()
-                    #zt.read_schedule()
-                    #zt.read_metadata()
-                    schedule_date = '{0}'.format(zt.schedule.Date)
-                    
-                    if zt.metadata.rx_xyz0.find(station[2:]) >= 0:
-                        fn_find = True
-                        if copy_date is not None:
-                            cp_date = int(''.join(copy_date.split('-')))
-                            
-                            fn_find = False
-                            
-                            zt_date = int(''.join(schedule_date.split('-')))
-                            if copy_type == 'before':
-                                if zt_date <= cp_date:
-                                    fn_find = True
-                            elif copy_type == 'after':
-                                if zt_date >= cp_date:
-                                    fn_find = True
-                            elif copy_type == 'on':
-                                if zt_date == cp_date:
-                                    fn_find = True
-                                                                
-                        if fn_find:
-                            channel = zt.metadata.ch_cmp.upper()
-                            st = zt.schedule.Time.replace(':','')
-                            sd = zt.schedule.Date.replace('-','')
-                            sv_fn = '{0}_{1}_{2}_{3}_{4}.Z3D'.format(station, 
-                                                                     sd, 
-                                                                     st,
-                                                                     int(zt.df),
-                                                                     channel)
-                                                                 
-                            full_path_sv = os.path.join(save_path, sv_fn)
-                            fn_list.append(full_path_sv)
-                            
-                            shutil.copy(full_path_fn, full_path_sv)
-                            print('copied {0} to {1}\n'.format(full_path_fn, 
-                                                             full_path_sv))
-                                                             
-                            #log_fid.writelines(zt.log_lines)
-                                                             
-                            log_fid.write('copied {0} to \n'.format(full_path_fn)+\
-                                          '       {0}\n'.format(full_path_sv))
-                        else:
-                            pass
-#                            print '+++ SKIPPED {0}+++\n'.format(zt.fn)
-#                            log_fid.write(' '*4+\
-#                                          '+++ SKIPPED {0}+++\n'.format(zt.fn))
-                        
-                    else:
-                        pass
-#                        print '{0} '.format(full_path_fn)+\
-#                               'not copied due to bad data.'
-#                               
-#                        log_fid.write(' '*4+'***{0} '.format(full_path_fn)+\
-#                                      'not copied due to bad data.\n\n')
-            except WindowsError:
-                print('Faulty file at {0}'.format(full_path_fn))
-                log_fid.write('---Faulty file at {0}\n\n'.format(full_path_fn))
-    log_fid.close()
+    for drive_fn_list in copy_list:
+        fn_list.extend(drive_fn_list)
     
     et_test = time.ctime()
     
     print('Started at: {0}'.format(st_test))
     print('Ended at: {0}'.format(et_test))
     return fn_list
- 
-
+    
+def copy_from_sd(station, save_path=r"d:\Peacock\MTData", 
+                 channel_dict={'1':'HX', '2':'HY', '3':'HZ',
+                               '4':'EX', '5':'EY', '6':'HZ'},
+                 copy_date=None, copy_type='all'):
+    """
+    copy files from sd cards into a common folder (save_path)
+    
+    do not put an underscore in station, causes problems at the moment
+    
+    Arguments:
+    -----------
+        **station** : string
+                      full name of station from which data is being saved
+        
+        **save_path** : string
+                       full path to save data to
+                       
+        **channel_dict** : dictionary
+                           keys are the channel numbers as strings and the
+                           values are the component that corresponds to that 
+                           channel, values are placed in upper case in the 
+                           code
+                           
+        **copy_date** : YYYY-MM-DD
+                        date to copy from depending on copy_type
+                        
+        **copy_type** : [ 'all' | 'before' | 'after' | 'on' ]
+                        * 'all' --> copy all files on the SD card
+                        * 'before' --> copy files before and on this date
+                        * 'after' --> copy files on and after this date
+                        * 'on' --> copy files on this date only
+                        
+    Outputs:
+    -----------
+        **fn_list** : list
+                     list of filenames copied to save_path
+                     
+    :Example: ::
+    
+        >>> import mtpy.usgs.zen as zen
+        >>> fn_list = zen.copy_from_sd('mt01', save_path=r"/home/mt/survey_1")
+    
+    """
+    
+    return transfer_from_sd(station, save_path=save_path, 
+                            channel_dict=channel_dict, copy_date=copy_date,
+                            copy_type=copy_type, delete_after=False)
     
 #==============================================================================
 # delete files from sd cards    
 #==============================================================================
+def _purge_file(fn, delete_folder=None):
+    """
+    delete fn, or move it into delete_folder if that is not None.  Returns
+    the line for the log.
+    """
+    if delete_folder is None:
+        os.remove(fn)
+        return 'Deleted {0}\n'.format(fn)
+    
+    shutil.move(fn, os.path.join(delete_folder, os.path.basename(fn)))
+    return 'Moved {0} to {1}\n'.format(fn, delete_folder)
+    
 def delete_files_from_sd(delete_date=None, delete_type=None, 
                          delete_folder=r"d:\Peacock\MTData\Deleted",
                          verbose=True):
@@ -2171,83 +3008,30 @@ def delete_files_from_sd(delete_date=None, delete_type=None,
     if delete_folder is not None:
         if not os.path.exists(delete_folder):
             os.mkdir(delete_folder)
-        log_fid = file(os.path.join(delete_folder,'Log_file.log'),'w')
     
-    if delete_date is not None:
-        delete_date = int(delete_date.replace('-',''))
+    date_test = _date_test(delete_date, delete_type)
+    # the information read from the cards is only kept for this call
+    info_cache = {}
     
     delete_fn_list = []
     for key in list(drive_names.keys()):
         dr = r"{0}:\\".format(key)
         log_lines.append('='*25+drive_names[key]+'='*25+'\n')
-        for fn in os.listdir(dr):
-            if fn[-4:].lower() == '.Z3D'.lower():
-                full_path_fn = os.path.normpath(os.path.join(dr, fn))
-                zt = Zen3D(full_path_fn)
-                zt.read_all_info()
+        for entry in os.scandir(dr):
+            if entry.name[-4:].lower() == '.Z3D'.lower():
+                full_path_fn = os.path.normpath(entry.path)
+                zt = read_z3d_info(full_path_fn, entry.stat(), info_cache)
                 zt_date = int(zt.schedule.Date.replace('-',''))
-                #zt.get_info()
-                if delete_type == 'all' or delete_date is None:
-                    if delete_folder is None:
-                        os.remove(full_path_fn)
-                        delete_fn_list.append(full_path_fn)
-                        log_lines.append('Deleted {0}'.format(full_path_fn))
-                    else:
-                        shutil.move(full_path_fn, 
-                                    os.path.join(delete_folder,
-                                    os.path.basename(full_path_fn)))
-                        delete_fn_list.append(full_path_fn)
-                        log_lines.append('Moved {0} '.format(full_path_fn)+
-                                         'to {0}'.format(delete_folder))
-                else:
-                    #zt_date = int(zt.schedule_date.replace('-',''))
-                   
-                    if delete_type == 'before':
-                        if zt_date <= delete_date:
-                            if delete_folder is None:
-                                os.remove(full_path_fn)
-                                delete_fn_list.append(full_path_fn)
-                                log_lines.append('Deleted {0}\n'.format(full_path_fn))
-                            else:
-                                shutil.move(full_path_fn, 
-                                            os.path.join(delete_folder,
-                                            os.path.basename(full_path_fn)))
-                                delete_fn_list.append(full_path_fn)
-                                log_lines.append('Moved {0} '.format(full_path_fn)+
-                                                 'to {0}\n'.format(delete_folder))
-                    elif delete_type == 'after':
-                        if zt_date >= delete_date:
-                            if delete_folder is None:
-                                os.remove(full_path_fn)
-                                delete_fn_list.append(full_path_fn)
-                                log_lines.append('Deleted {0}\n'.format(full_path_fn))
-                            else:
-                                shutil.move(full_path_fn, 
-                                            os.path.join(delete_folder,
-                                            os.path.basename(full_path_fn)))
-                                delete_fn_list.append(full_path_fn)
-                                log_lines.append('Moved {0} '.format(full_path_fn)+
-                                                 'to {0}\n'.format(delete_folder))
-                    elif delete_type == 'on':
-                        if zt_date == delete_date:
-                            if delete_folder is None:
-                                os.remove(full_path_fn)
-                                delete_fn_list.append(full_path_fn)
-                                log_lines.append('Deleted {0}\n'.format(full_path_fn))
-                            else:
-                                shutil.move(full_path_fn, 
-                                            os.path.join(delete_folder,
-                                            os.path.basename(full_path_fn)))
-                                delete_fn_list.append(full_path_fn)
-                                log_lines.append('Moved {0} '.format(full_path_fn)+
-                                                 'to {0}\n'.format(delete_folder))
+                if date_test(zt_date):
+                    log_lines.append(_purge_file(full_path_fn, delete_folder))
+                    delete_fn_list.append(full_path_fn)
     if delete_folder is not None:
-        log_fid = file(os.path.join(delete_folder, 'Delete_log.log'), 'w')
-        log_fid.writelines(log_lines)
-        log_fid.close()
+        with open(os.path.join(delete_folder, 'Delete_log.log'), 'w',
+                  buffering=_log_buffer_len) as log_fid:
+            log_fid.write(''.join(log_lines))
     if verbose:
         for lline in log_lines:
-            print(lline)
+            print(lline, end='')
     
     return delete_fn_list
     
@@ -2257,10 +3041,49 @@ def delete_files_from_sd(delete_date=None, delete_type=None,
 #   Make mtpy_mt files  
 #==============================================================================
     
+# one line of the array returned by make_mtpy_mt_files, start_dt is
+# YYYY-MM-DD,hh:mm:ss.ffffff and fn is as long as a windows path can be
+_fn_arr_dtype = np.dtype([('station', '|S16'), ('len', np.int64), 
+                          ('df', np.int64), ('start_dt', '|S26'), 
+                          ('comp', '|S2'), ('fn', '|S260')])
+    
+def _process_one_z3d(fn, station_name='mb', fmt='%.8e', notch_dict=None,
+                     ey_skip=False):
+    """
+    write a mtpy time series file for a single .Z3D file, module level so
+    it can be sent to a worker process.
+
+    Returns (record, log_line) where record is a tuple matching the fields
+    of fn_arr in make_mtpy_mt_files, both are None if the file is skipped.
+    """
+    zd = _load_or_parse_z3d(fn)
+    if ey_skip and zd.metadata.ch_cmp == 'ey':
+        return None, None
+
+    #write mtpy mt file, reads in the data if needed
+    zd.write_ascii_mt_file(fmt=fmt, notch_dict=notch_dict)
+
+    #create lines to write to a log file
+    station = '{0}{1}'.format(station_name, zd.station)
+    ts_len = zd.ts_obj.n_samples
+    record = (station, ts_len, zd.df, zd.zen_schedule, zd.metadata.ch_cmp,
+              zd.fn)
+    log_line = ''.join(['--> station: {0}\n'.format(station),
+                        '    ts_len = {0}\n'.format(ts_len),
+                        '    df = {0}\n'.format(zd.df),
+                        '    start_dt = {0}\n'.format(zd.zen_schedule),
+                        '    comp = {0}\n'.format(zd.metadata.ch_cmp),
+                        '    fn = {0}\n'.format(zd.fn)])
+    return record, log_line
+
 def make_mtpy_mt_files(fn_list, station_name='mb', fmt='%.8e', 
-                       ex=1, ey=1, notch_dict=None, ey_skip=False):
+                       ex=1, ey=1, notch_dict=None, ey_skip=False,
+                       workers=None):
     """
-    makes mtpy_mt files from .Z3D files
+    makes mtpy_mt files from .Z3D files, the files are processed in 
+    parallel worker processes.  Worker processes are started fresh on 
+    Windows, so call this from under if __name__ == '__main__': or use 
+    workers=1 to process the files in the calling process.
     
     Arguments:
     -----------
@@ -2268,11 +3091,20 @@ def make_mtpy_mt_files(fn_list, station_name='mb', fmt='%.8e',
         
         **station_name** : prefix for station names
         
-        **fmt** : format of data numbers for mt_files
+        **fmt** : format of data numbers for mt_files, applied to a whole
+                  chunk of samples at once by MT_TS.write_ascii_file
+        
+        **ex**, **ey** : kept for backwards compatibility, the dipole
+                         lengths are now read from the Z3D metadata
+        
+        **workers** : number of worker processes, 0 or 1 processes the
+                      files one after another in the calling process
+                      *default* is half the number of cpus
         
     Outputs:
     --------
-        **fn_arr** : np.ndarray(file, length, df, start_dt)
+        **fn_arr** : np.ndarray(station, len, df, start_dt, comp, fn)
+                     one line for each file written
         
     :Example: ::
     
@@ -2281,48 +3113,36 @@ def make_mtpy_mt_files(fn_list, station_name='mb', fmt='%.8e',
         >>> mtpy_fn = zen.make_mtpy_files(fn_list, station_name='mt')
     """
     
-    fn_arr = np.zeros(len(fn_list), 
-                      dtype=[('station','|S6'), ('len',np.int), ('df', np.int),
-                             ('start_dt', '|S22'), ('comp','|S2'),
-                             ('fn','|S100')])
+    rows = []
     fn_lines = []
-                             
-    for ii, fn in enumerate(fn_list):
-        zd = Zen3D(fn)
-        
-        #read in Z3D data
-        try:
-            zd.read_3d()
-        except ZenGPSError:
-            try:
-                zd._seconds_diff = 59
-                zd.read_3d()
-            except ZenGPSError:
-                pass
-        if ey_skip and zd.ch_cmp == 'ey':
-            pass
-        else:
-            #write mtpy mt file
-            zd.write_ascii_mt_file(save_station=station_name, 
-                                   fmt=fmt, 
-                                   ex=ex, 
-                                   ey=ey, 
-                                   notch_dict=notch_dict)
-            
-            #create lines to write to a log file                       
-            fn_arr[ii]['station'] = '{0}{1}'.format(station_name, zd.rx_stn)
-            fn_arr[ii]['len'] = zd.time_series.shape[0]
-            fn_arr[ii]['df'] = zd.df
-            fn_arr[ii]['start_dt'] = zd.start_dt
-            fn_arr[ii]['comp'] = zd.ch_cmp
-            fn_arr[ii]['fn'] = zd.fn
-            fn_lines.append(''.join(['--> station: {0}{1}\n'.format(station_name, 
-                                                                     zd.rx_stn),
-                                     '    ts_len = {0}\n'.format(zd.time_series.shape[0]),
-                                     '    df = {0}\n'.format(zd.df),
-                                     '    start_dt = {0}\n'.format(zd.start_dt),
-                                     '    comp = {0}\n'.format(zd.ch_cmp),
-                                     '    fn = {0}\n'.format(zd.fn)]))
+    if len(fn_list) == 0:
+        return np.array(rows, dtype=_fn_arr_dtype), fn_lines
+
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 2)//2)
+    process_z3d = partial(_process_one_z3d, 
+                          station_name=station_name,
+                          fmt=fmt,
+                          notch_dict=notch_dict,
+                          ey_skip=ey_skip)
+
+    # map returns in the order of fn_list, skipped files are left out
+    if workers <= 1:
+        result_list = list(map(process_z3d, fn_list))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            result_list = list(executor.map(process_z3d, fn_list, 
+                                            chunksize=4))
+    for record, log_line in result_list:
+        if record is None:
+            continue
+        station, ts_len, df, start_dt, comp, fn = record
+        rows.append((station.encode(), ts_len, df, start_dt.encode(),
+                     comp.encode(), fn.encode()))
+        fn_lines.append(log_line)
+    
+    # convert all the rows at once
+    fn_arr = np.array(rows, dtype=_fn_arr_dtype)
         
     return fn_arr, fn_lines
     
@@ -2331,9 +3151,13 @@ def make_mtpy_mt_files(fn_list, station_name='mb', fmt='%.8e',
 #==============================================================================
 def make_mtpy_ts_loop(station_path, station_list, survey_file=None, 
                       station_name='mb', fmt='%.8e', notch_dict=None,
-                      ey_skip=False):
+                      ey_skip=False, workers=None):
     """
-    loop over station folder to write mtpy time series
+    loop over station folder to write mtpy time series.  The files of a 
+    station are processed in parallel worker processes by 
+    make_mtpy_mt_files, which are started fresh on Windows, so call this 
+    from under if __name__ == '__main__': or use workers=1 to process the 
+    files in the calling process.
     
     Arguments:
     ----------
@@ -2373,10 +3197,14 @@ def make_mtpy_ts_loop(station_path, station_list, survey_file=None,
                                            Any difference above dbstop_limit
                                            will be filtered, anything
                                            less will not
+                                           
+        **workers** : number of worker processes for each station, 0 or 1
+                      processes the files in the calling process
+                      *default* is half the number of cpus
                          
     """
     
-    log_fid = file(os.path.join(station_path, 'TS_log.log'), 'a')
+    log_lines = []
     
     if survey_file is not None:
         survey_dict = mtcf.read_survey_configfile(survey_file)
@@ -2395,17 +3223,21 @@ def make_mtpy_ts_loop(station_path, station_list, survey_file=None,
             ex = 1.
             ey = 1.
         
-        log_fid.write('-'*72+'\n')
-        fn_list = [os.path.join(spath, fn) for fn in os.listdir(spath)
-                  if fn[-3:]=='Z3D']
+        log_lines.append('-'*72+'\n')
+        fn_list = [entry.path for entry in os.scandir(spath)
+                   if entry.name[-3:]=='Z3D']
         sfn_arr, sfn_lines = make_mtpy_mt_files(fn_list, 
                                                 station_name=station_name,
                                                 fmt=fmt, 
                                                 ex=ex, 
                                                 ey=ey,
                                                 notch_dict=notch_dict,
-                                                ey_skip=ey_skip)
-        log_fid.writelines(sfn_lines)
-    log_fid.close()
+                                                ey_skip=ey_skip,
+                                                workers=workers)
+        log_lines.extend(sfn_lines)
+        
+    with open(os.path.join(station_path, 'TS_log.log'), 'a',
+              buffering=_log_buffer_len) as log_fid:
+        log_fid.write(''.join(log_lines))
     
 #==============================================================================
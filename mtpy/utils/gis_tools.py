@@ -88,16 +88,20 @@ def assert_lat_value(latitude):
     """
     make sure latitude is in decimal degrees
     """
-    if latitude in [None, 'None']:
-        return None
-    try:
+    # numbers are the common case, only strings need parsing
+    if isinstance(latitude, (float, int, np.number)):
         lat_value = float(latitude)
-
-    except TypeError:
+    elif latitude in [None, 'None']:
         return None
+    else:
+        try:
+            lat_value = float(latitude)
 
-    except ValueError:
-        lat_value = convert_position_str2float(latitude)
+        except TypeError:
+            return None
+
+        except ValueError:
+            lat_value = convert_position_str2float(latitude)
 
     if abs(lat_value) >= 90:
         print("==> The lat_value =", lat_value)
@@ -110,16 +114,20 @@ def assert_lon_value(longitude):
     """
     make sure longitude is in decimal degrees
     """
-    if longitude in [None, 'None']:
-        return None
-    try:
+    # numbers are the common case, only strings need parsing
+    if isinstance(longitude, (float, int, np.number)):
         lon_value = float(longitude)
-
-    except TypeError:
+    elif longitude in [None, 'None']:
         return None
+    else:
+        try:
+            lon_value = float(longitude)
 
-    except ValueError:
-        lon_value = convert_position_str2float(longitude)
+        except TypeError:
+            return None
+
+        except ValueError:
+            lon_value = convert_position_str2float(longitude)
 
     if abs(lon_value) >= 180:
         raise ValueError('|Longitude| > 180, unacceptable!')
@@ -131,6 +139,8 @@ def assert_elevation_value(elevation):
     """
     make sure elevation is a floating point number
     """
+    if isinstance(elevation, (float, int, np.number)):
+        return float(elevation)
 
     try:
         elev_value = float(elevation)
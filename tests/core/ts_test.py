@@ -80,3 +80,71 @@ def test():
     h5_fn = _make_hdf5_from_z3d(fn)
     txt_fn = _make_txt_from_hdf5(h5_fn, chunk=8192)
     ts_obj = _read_txt(txt_fn)
+
+
+def _make_ts_obj(n_samples=4096, sampling_rate=256.):
+    import numpy as np
+
+    ts_obj = mtts.MT_TS()
+    ts_obj.ts = np.random.randn(n_samples)
+    ts_obj.sampling_rate = sampling_rate
+    ts_obj.start_time_utc = '2017-05-04 12:32:00.00'
+    ts_obj.station = 'mt01'
+    ts_obj.component = 'ex'
+    ts_obj.lat = 40.0
+    ts_obj.lon = -120.0
+
+    return ts_obj
+
+
+def test_hdf5_round_trip(tmpdir):
+    pytest.importorskip('tables')
+    import numpy as np
+
+    ts_obj = _make_ts_obj()
+    h5_fn = ts_obj.write_hdf5(os.path.join(str(tmpdir), 'mt01.h5'))
+
+    ts_read = mtts.MT_TS()
+    ts_read.read_hdf5(h5_fn)
+
+    assert np.allclose(ts_read.ts.data.values, ts_obj.ts.data.values)
+    assert (ts_read.ts.index == ts_obj.ts.index).all()
+    assert ts_read.sampling_rate == ts_obj.sampling_rate
+    assert ts_read.start_time_utc == ts_obj.start_time_utc
+    assert ts_read.station == 'mt01'
+
+    ts_core = mtts.MT_TS()
+    ts_core.read_hdf5(h5_fn, in_memory=True)
+    assert np.allclose(ts_core.ts.data.values, ts_obj.ts.data.values)
+
+
+def test_ascii_round_trip(tmpdir):
+    import numpy as np
+
+    ts_obj = _make_ts_obj(n_samples=1000)
+    ascii_fn = os.path.join(str(tmpdir), 'mt01.EX')
+    ts_obj.write_ascii_file(ascii_fn, chunk_size=256)
+
+    ts_read = mtts.MT_TS()
+    ts_read.read_ascii(ascii_fn)
+
+    assert ts_read.n_samples == ts_obj.n_samples
+    assert np.allclose(ts_read.ts.data.values, ts_obj.ts.data.values)
+    assert ts_read.start_time_utc == ts_obj.start_time_utc
+
+
+def test_feather_round_trip(tmpdir):
+    pytest.importorskip('pyarrow')
+    import numpy as np
+
+    ts_obj = _make_ts_obj()
+    feather_fn = ts_obj.write_feather(os.path.join(str(tmpdir),
+                                                   'mt01.feather'))
+
+    ts_read = mtts.MT_TS()
+    ts_read.read_feather(feather_fn)
+
+    assert np.allclose(ts_read.ts.data.values, ts_obj.ts.data.values)
+    assert (ts_read.ts.index == ts_obj.ts.index).all()
+    assert ts_read.sampling_rate == ts_obj.sampling_rate
+    assert ts_read.lat == ts_obj.lat
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for reading Z3D files with mtpy.usgs.zen, the files are built from
+scratch so no field data are needed.
+"""
+import os
+import json
+
+import numpy as np
+
+import mtpy.usgs.zen as zen
+
+# gps stamp words, flags then time and the rest of the stamp
+_stamp_dtype = np.dtype([('flag0', '<i4'), ('flag1', '<i4'), ('time', '<i4'),
+                         ('lat', '<f8'), ('lon', '<f8'), ('num_sat', '<i4'),
+                         ('gps_sens', '<i4'), ('temperature', '<f4'),
+                         ('voltage', '<f4'), ('num_fpga', '<i4'),
+                         ('num_adc', '<i4'), ('pps_count', '<i4'),
+                         ('dac_tune', '<i4'), ('block_len', '<i4')])
+
+_header_block = ('\nGPS Brd339/Brd357 Metadata\r\n Version = 4147\n'
+                 ' Main.hex Buildnum = 5357\nChannelSerial = 0xD474777C\n'
+                 'Box Serial = 0x0000010F\nBox number = 24\nChannel = 5\n'
+                 'A/D Gain = 1\nA/D Rate = {df}\nLat = 0.706816081\n'
+                 'Long = -2.038914402\nAlt = 1.13e3\nNumSats = 17\n'
+                 'GpsWeek = 1740\n')
+
+_schedule_block = ('\n\n\nGPS Brd339/Brd357 Schedule Details\n'
+                   'Schedule.Date = {date}\nSchedule.Time = {time}\n'
+                   'Schedule.Sync = Y\nSchedule.S/R = 0\n'
+                   'Schedule.Filename = test.Z3D\nSchedule.Comment = \n')
+
+_key_record = ('\n\n\nMetadata Record 1\ngdp.operator=jp|job.by=usgs|'
+               'line.name,um|rx.aspace=100|rx.xyz0=102:0:0|'
+               'rx.yazimuth=90|ch.azimuth=0|ch.cmp=ex|ch.length=100|'
+               'ch.number=4|\n')
+
+def _pad(block, block_len=512):
+    """
+    pad a text block of a Z3D file with \\x00 to block_len bytes
+    """
+    block = block.encode('ascii')
+    assert len(block) <= block_len
+    return block+b'\x00'*(block_len-len(block))
+
+def _make_z3d(fn, df=256, n_sec=20, block_len_dict=None,
+              date='2017-06-06', time='23:05:16', records=None):
+    """
+    write a Z3D file with n_sec gps stamps each followed by df samples,
+    unless the block after stamp ii is given a different length in
+    block_len_dict.  Returns the samples after each stamp.
+    """
+    if block_len_dict is None:
+        block_len_dict = {}
+    if records is None:
+        records = [_key_record]
+
+    prologue = _pad(_header_block.format(df=df))+\
+               _pad(_schedule_block.format(date=date, time=time))+\
+               b''.join([_pad(record) for record in records])
+
+    data_blocks = []
+    block_list = []
+    for ii in range(n_sec):
+        stamp = np.zeros(1, dtype=_stamp_dtype)
+        stamp['flag0'] = 2147483647
+        stamp['flag1'] = -2147483648
+        stamp['time'] = (257116+ii)*1024
+        stamp['num_sat'] = 9
+        data_blocks.append(stamp.tobytes())
+
+        n_samples = block_len_dict.get(ii, df)
+        samples = (np.arange(n_samples, dtype='<i4')-n_samples//2)*(ii+1)
+        block_list.append(samples)
+        data_blocks.append(samples.tobytes())
+
+    with open(fn, 'wb') as fid:
+        fid.write(prologue+b''.join(data_blocks))
+
+    return block_list
+
+def _read_z3d(fn):
+    z3d_obj = zen.Zen3D(fn)
+    z3d_obj.read_z3d()
+    return z3d_obj
+
+def test_read_z3d(tmpdir):
+    fn = os.path.join(str(tmpdir), 'test.Z3D')
+    block_list = _make_z3d(fn)
+    z3d_obj = _read_z3d(fn)
+
+    # the first 3 stamps are skipped
+    assert z3d_obj.gps_stamps.size == 17
+    assert z3d_obj.gps_stamps['block_len'][0] == 0
+    assert (z3d_obj.gps_stamps['block_len'][1:] == 256).all()
+    assert np.allclose(z3d_obj.gps_stamps['time'],
+                       np.arange(257119, 257136))
+
+    # the data after the 4th stamp in mV, a legitimate 0 is kept
+    counts = np.concatenate(block_list[3:])
+    assert (counts == 0).sum() == 17
+    assert z3d_obj.ts_obj.ts.data.dtype == np.float32
+    assert z3d_obj.ts_obj.n_samples == counts.size
+    assert np.array_equal(z3d_obj.ts_obj.ts.data.values,
+                          counts.astype(np.float32)*\
+                          np.float32(z3d_obj._counts_to_mv_conversion))
+
+    # the data start 2 s after the scheduled time
+    assert z3d_obj.ts_obj.start_time_utc == '2017-06-06 23:05:18.000000'
+    assert str(z3d_obj.ts_obj.ts.index[0]) == '2017-06-06 23:05:18'
+    assert z3d_obj.metadata.ch_cmp == 'ex'
+    assert z3d_obj.station == 'um102'
+
+def test_read_z3d_short_leading_block(tmpdir):
+    fn = os.path.join(str(tmpdir), 'test.Z3D')
+    block_list = _make_z3d(fn, block_len_dict={5:200})
+    z3d_obj = _read_z3d(fn)
+
+    # the blocks up to the short one are dropped, 2 s of data
+    counts = np.concatenate(block_list[5:])
+    assert z3d_obj.ts_obj.n_samples == counts.size
+    assert np.array_equal(z3d_obj.ts_obj.ts.data.values,
+                          counts.astype(np.float32)*\
+                          np.float32(z3d_obj._counts_to_mv_conversion))
+    assert np.allclose(z3d_obj.gps_stamps['time'][0], 257121)
+    assert z3d_obj.ts_obj.start_time_utc == '2017-06-06 23:05:20.000000'
+    assert str(z3d_obj.ts_obj.ts.index[0]) == '2017-06-06 23:05:20'
+
+def test_read_header():
+    header_obj = zen.Z3D_Header.from_buffer(
+                                _pad(_header_block.format(df=4096)))
+
+    assert header_obj.ad_rate == 4096.
+    assert header_obj.ad_gain == 1.
+    assert header_obj.version == 4147.
+    assert header_obj.main_hex_buildnum == 5357.
+    assert header_obj.box_serial == '0x0000010F'
+    assert header_obj.channelserial == '0xD474777C'
+    assert header_obj.box_number == 24.
+    assert header_obj.gpsweek == 1740.
+    assert np.isclose(header_obj.lat, np.degrees(0.706816081))
+    assert np.isclose(header_obj.long, np.degrees(-2.038914402))
+    assert header_obj.alt == 1130.
+
+def _read_schedule(date, time):
+    prologue = _pad(_header_block.format(df=256))+\
+               _pad(_schedule_block.format(date=date, time=time))
+    return zen.Z3D_Schedule_metadata.from_buffer(prologue)
+
+def test_read_schedule():
+    schedule_obj = _read_schedule('2017-06-06', '23:05:16')
+
+    # the first good stamp is 2 s after the scheduled time
+    assert schedule_obj.Date == '2017-06-06'
+    assert schedule_obj.Time == '23:05:18'
+    assert schedule_obj.Sync == 'Y'
+    assert schedule_obj.SR == '0'
+    assert schedule_obj.Filename == 'test.Z3D'
+    assert schedule_obj.Comment == ''
+
+def test_read_schedule_carry():
+    schedule_obj = _read_schedule('2017-06-06', '23:59:57')
+    assert (schedule_obj.Date, schedule_obj.Time) == ('2017-06-06',
+                                                      '23:59:59')
+
+    schedule_obj = _read_schedule('2017-06-06', '23:59:59')
+    assert (schedule_obj.Date, schedule_obj.Time) == ('2017-06-07',
+                                                      '00:00:01')
+
+    schedule_obj = _read_schedule('2017-12-31', '23:59:58')
+    assert (schedule_obj.Date, schedule_obj.Time) == ('2018-01-01',
+                                                      '00:00:00')
+
+_board_record = ('\n\n\nMetadata Record 2\n'
+                 'CAL.BRD,1.0,256:1:1.0:0.0,1024:4:1.1:0.1,\x00\n')
+
+# the coil calibration starts inline after CAL.ANT= and continues in the
+# next record
+_coil_records = ['\n\n\nMetadata Record 3\n'
+                 'Cal.Ver,031|CAL.ANT=2314,1e-4:1.0:90,2e-4:1.1:89\n',
+                 '\n\n\nMetadata Record 4\n'
+                 'Cal.Ant,2314|0,4e-4:1.2:88,8e-4:1.3:87\n']
+
+def _read_metadata(records):
+    prologue = _pad(_header_block.format(df=256))+\
+               _pad(_schedule_block.format(date='2017-06-06',
+                                           time='23:05:16'))+\
+               b''.join([_pad(record) for record in records])
+    return zen.Z3D_Metadata.from_buffer(prologue)
+
+def test_read_metadata_key_record():
+    metadata_obj = _read_metadata([_key_record])
+
+    assert metadata_obj.count == 1
+    assert metadata_obj.m_tell == 1536
+    assert metadata_obj.gdp_operator == 'jp'
+    assert metadata_obj.job_by == 'usgs'
+    assert metadata_obj.line_name == 'um'
+    assert metadata_obj.rx_aspace == '100'
+    assert metadata_obj.rx_xyz0 == '102:0:0'
+    assert metadata_obj.ch_cmp == 'ex'
+    assert metadata_obj.ch_length == '100'
+    assert metadata_obj.station == 'um102'
+    assert metadata_obj.board_cal is None
+    assert metadata_obj.coil_cal is None
+
+def test_read_metadata_board_cal():
+    metadata_obj = _read_metadata([_key_record, _board_record])
+
+    assert metadata_obj.count == 2
+    assert metadata_obj.cal_brd == '1.0'
+    assert np.array_equal(metadata_obj.board_cal.frequency, [256, 1024])
+    assert np.array_equal(metadata_obj.board_cal.rate, [1, 4])
+    assert np.array_equal(metadata_obj.board_cal.amplitude, [1.0, 1.1])
+    assert np.array_equal(metadata_obj.board_cal.phase, [0.0, 0.1])
+    assert metadata_obj.coil_cal is None
+
+def test_read_metadata_coil_cal():
+    metadata_obj = _read_metadata([_key_record]+_coil_records)
+
+    assert metadata_obj.count == 3
+    assert metadata_obj.m_tell == 2560
+    assert metadata_obj.cal_ver == '031'
+    assert metadata_obj.cal_ant == '2314'
+    assert np.array_equal(metadata_obj.coil_cal.frequency,
+                          [1e-4, 2e-4, 4e-4, 8e-4])
+    assert np.array_equal(metadata_obj.coil_cal.amplitude,
+                          [1.0, 1.1, 1.2, 1.3])
+    assert np.array_equal(metadata_obj.coil_cal.phase, [90, 89, 88, 87])
+    assert metadata_obj.board_cal is None
+
+def test_read_metadata_bad_cal():
+    # a value that is not a number and an entry with too few values
+    metadata_obj = _read_metadata([_key_record,
+                                   _board_record.replace('1.1', 'bad'),
+                                   _coil_records[0].replace(':89', '')])
+
+    assert metadata_obj.board_cal is None
+    assert metadata_obj.coil_cal is None
+    assert metadata_obj.station == 'um102'
+
+def _schedule_times(time_list):
+    return [(tt['dt'], tt['df'], tt['sr']) for tt in time_list]
+
+def test_make_schedule():
+    zen_schedule = zen.ZenSchedule()
+    time_list = zen_schedule.make_schedule([4096, 256],
+                                           ['00:10:00', '07:50:00'],
+                                           repeat=2)
+
+    assert _schedule_times(time_list) == \
+           [('2000-01-01,00:00:00', 4096, '4'),
+            ('2000-01-01,00:10:00', 256, '0'),
+            ('2000-01-01,08:00:00', 4096, '4'),
+            ('2000-01-01,08:10:00', 256, '0'),
+            ('2000-01-01,16:00:00', 4096, '4')]
+    assert time_list[1]['date'] == '2000-01-01'
+    assert time_list[1]['time'] == '00:10:00'
+
+    # the next event after the offset is 5 minutes away and the offset
+    # falls in the 4096 block
+    t1_dict = zen_schedule.get_schedule_offset('00:05:00', time_list)
+    assert t1_dict == {'dt':'2000-01-01,00:05:00', 'df':4096}
+    assert zen_schedule.get_schedule_offset('03:00:00', time_list) == \
+           {'dt':'2000-01-01,05:00:00', 'df':256}
+    assert zen_schedule.get_schedule_offset('16:00:00', time_list) is None
+
+    # the offset schedule switches rate at the same times as the master
+    offset_list = zen_schedule.make_schedule([4096, 256],
+                                             ['00:10:00', '07:50:00'],
+                                             repeat=2, t1_dict=t1_dict)
+    assert _schedule_times(offset_list) == \
+           [('2000-01-01,00:00:00', 4096, '4'),
+            ('2000-01-01,00:05:00', 256, '0'),
+            ('2000-01-01,07:55:00', 4096, '4'),
+            ('2000-01-01,08:05:00', 256, '0'),
+            ('2000-01-01,15:55:00', 4096, '4'),
+            ('2000-01-01,16:05:00', 256, '0')]
+
+def test_load_or_parse_z3d(tmpdir):
+    fn = os.path.join(str(tmpdir), 'test.Z3D')
+    _make_z3d(fn, records=[_key_record, _board_record]+_coil_records)
+    z3d_obj = zen._load_or_parse_z3d(fn)
+    cache_fn = os.path.join(str(tmpdir), zen._z3d_cache_dir, 'test.Z3D.json')
+    assert os.path.isfile(cache_fn)
+
+    # the second time the information comes from the cache
+    cache_obj = zen._load_or_parse_z3d(fn)
+    assert cache_obj._info_fn == fn
+    assert cache_obj.df == z3d_obj.df == 256.
+    assert cache_obj.zen_schedule == z3d_obj.zen_schedule
+    assert cache_obj.header.header_str == z3d_obj.header.header_str
+    assert cache_obj.metadata.m_tell == z3d_obj.metadata.m_tell
+    assert cache_obj.metadata.station == 'um102'
+    assert np.array_equal(cache_obj.metadata.board_cal,
+                          z3d_obj.metadata.board_cal)
+    assert np.array_equal(cache_obj.metadata.coil_cal.phase,
+                          z3d_obj.metadata.coil_cal.phase)
+
+    # the data are read with the cached information
+    cache_obj.read_z3d()
+    assert cache_obj.ts_obj.start_time_utc == '2017-06-06 23:05:18.000000'
+
+    # a cache that can not be read is parsed again
+    with open(cache_fn, 'w') as fid:
+        fid.write('{"key": [')
+    assert zen._load_or_parse_z3d(fn)._info_fn == fn
+    with open(cache_fn, 'r') as fid:
+        assert json.load(fid)['metadata']['station'] == 'um102'